@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+"""Benchmarks for the hot paths of the bot. Run with the name of a benchmark, e.g. python benchmark.py storage"""
+
+from pathlib import Path
+from types import SimpleNamespace
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import yaml
+from function import Function
+from gameSettings import GameSettings
+import gameSettings
+from guessTable import GuessTable
+from log import Log
+from metrics import registry as metrics
+from outbox import Outbox
+from playerStatistics import StatisticsStore
+from runtime import Runtime
+from sharding import Dispatcher, startWorkers
+from solver import Solver
+from storage import openStorage
+from transport import FakeTransport, makeUpdate
+
+
+def timeIt(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def getGroupState(groupId):
+    players = [{"id": groupId * 10 + i, "name": "player{}".format(i), "score": i} for i in range(3)]
+    return {"id": groupId, "players": players, "settings": GameSettings().getState()}
+
+
+def getLegacySettings():
+    # Settings used to be a SimpleNamespace that also held the names and help texts
+    settings = GameSettings()
+    return SimpleNamespace(**settings.getState(), names=gameSettings.names, helpTexts=gameSettings.helpTexts)
+
+
+def benchmarkLegacyYaml(folder, groupIds):
+    def save():
+        for groupId in groupIds:
+            state = getGroupState(groupId)
+            players = [SimpleNamespace(**player) for player in state["players"]]
+            with Path(folder, str(groupId)).open("w") as f:
+                yaml.dump([groupId, players, getLegacySettings()], f)
+
+    def load():
+        for groupId in groupIds:
+            with Path(folder, str(groupId)).open("r") as f:
+                yaml.load(f, Loader=yaml.UnsafeLoader)
+
+    return (timeIt(save), timeIt(load))
+
+
+def benchmarkStorage(storage, groupIds):
+    def save():
+        storage.saveMany((groupId, getGroupState(groupId)) for groupId in groupIds)
+
+    def load():
+        for groupId in groupIds:
+            storage.load(groupId)
+
+    return (timeIt(save), timeIt(load))
+
+
+def runStorageBenchmark(args):
+    groupIds = list(range(args.numGroups))
+    with tempfile.TemporaryDirectory() as folder:
+        results = {"legacy yaml": benchmarkLegacyYaml(Path(folder), groupIds)}
+        for backend in ["yaml", "sqlite"]:
+            storage = openStorage(backend, Path(folder, backend))
+            results[backend] = benchmarkStorage(storage, groupIds)
+            storage.close()
+    print("{:<12} {:>14} {:>14}".format("backend", "saves/s", "loads/s"))
+    for (name, (saveTime, loadTime)) in results.items():
+        print("{:<12} {:>14,.0f} {:>14,.0f}".format(name, len(groupIds) / saveTime, len(groupIds) / loadTime))
+
+
+def getFirstObviousRootBySorting(function, guessedValues):
+    # The previous implementation of Game.getFirstObviousRoot
+    sortedX = sorted(list(guessedValues))
+    for (x1, x2) in zip(sortedX, sortedX[1:]):
+        if (x1 + 2 == x2) and function(x1) * function(x2) < 0:
+            return x1 + 1
+    return None
+
+
+def runObviousRootBenchmark(args):
+    rng = random.Random(args.seed)
+    sweeps = {
+        "dense 0..100": (100, [x for x in range(0, 101, 2)] + [x for x in range(1, 101, 2)]),
+        "wide 0..{}".format(args.upperBound): (args.upperBound, [rng.randint(0, args.upperBound) for _ in range(args.numGuesses)]),
+    }
+    print("{:<20} {:>16} {:>16}".format("sweep", "sorting guess/s", "table guess/s"))
+    for (name, (upperBound, guesses)) in sweeps.items():
+        function = Function(0, 0, upperBound, [rng.randint(0, upperBound) for _ in range(args.numRoots)])
+
+        def runSorting():
+            guessedValues = set()
+            for x in guesses:
+                guessedValues.add(x)
+                getFirstObviousRootBySorting(function, guessedValues)
+
+        def runTable():
+            guessedValues = GuessTable(function)
+            for x in guesses:
+                guessedValues.add(x)
+                guessedValues.getFirstObviousRoot()
+
+        guessedValues = set()
+        table = GuessTable(function)
+        for x in guesses:
+            guessedValues.add(x)
+            table.add(x)
+            assert getFirstObviousRootBySorting(function, guessedValues) == table.getFirstObviousRoot()
+        print("{:<20} {:>16,.0f} {:>16,.0f}".format(name, len(guesses) / timeIt(runSorting), len(guesses) / timeIt(runTable)))
+
+
+def recapByFormattingEverything(function, guessedValues):
+    # The previous implementation of Game.recap
+    lines = []
+    numberIndentation = max(len("{:,}".format(function(x))) for x in guessedValues)
+    xIndentation = max(len("{}".format(x)) for x in guessedValues)
+    for x in sorted(guessedValues):
+        lines.append("`f({:<{xIndentation},}) = {:>{numberIndentation},}`".format(x, function(x), numberIndentation=numberIndentation, xIndentation=xIndentation))
+    return "\n".join(lines)
+
+
+def runRecapBenchmark(args):
+    rng = random.Random(args.seed)
+    function = Function(0, 0, args.upperBound, [rng.randint(0, args.upperBound) for _ in range(args.numRoots)])
+    guesses = [rng.randint(0, args.upperBound) for _ in range(args.numGuesses)]
+
+    def runFormattingEverything():
+        guessedValues = set()
+        for x in guesses:
+            guessedValues.add(x)
+            recapByFormattingEverything(function, guessedValues)
+
+    def runTable(onlyNewRows):
+        guessedValues = GuessTable(function)
+        log = Log()
+        for x in guesses:
+            guessedValues.add(x)
+            for (x, line) in guessedValues.takeRecapLines(onlyNewRows):
+                log.write("{line}", kind="recapRow", x=x, line=line)
+            log.dump()
+
+    print("Recap after each of {:,} guesses with {} roots in 0..{:,}".format(len(guesses), args.numRoots, args.upperBound))
+    print("formatting everything: {:.3f}s".format(timeIt(runFormattingEverything)))
+    print("guess table:           {:.3f}s".format(timeIt(lambda: runTable(False))))
+    print("guess table, compact:  {:.3f}s".format(timeIt(lambda: runTable(True))))
+
+
+def runSolverBenchmark(args):
+    rng = random.Random(args.seed)
+    numObviousRoots = numForcedRoots = numCandidates = 0
+    duration = 0
+    for _ in range(args.numGames):
+        function = Function(0, 0, args.upperBound, [rng.randint(0, args.upperBound) for _ in range(args.numRoots)])
+        guessedValues = GuessTable(function)
+        start = time.perf_counter()
+        solver = Solver(function)
+        for _ in range(args.numGuesses):
+            x = rng.randint(0, args.upperBound)
+            guessedValues.add(x)
+            solver.add(x)
+        duration += time.perf_counter() - start
+        assert all(function.isRoot(x) for x in solver.forcedRoots)
+        numObviousRoots += len(guessedValues.obviousRoots)
+        numForcedRoots += len(solver.forcedRoots)
+        numCandidates += solver.numCandidates
+    numGuesses = args.numGames * args.numGuesses
+    print("{:,} games with {} roots in 0..{:,} after {:,} guesses each".format(args.numGames, args.numRoots, args.upperBound, args.numGuesses))
+    print("solver: {:.3f}s ({:.1f}us per guess)".format(duration, duration / numGuesses * 1e6))
+    print("obvious roots: {:,}, forced roots: {:,}".format(numObviousRoots, numForcedRoots))
+    print("candidate roots left per game: {:,.1f} of {:,} values".format(numCandidates / args.numGames, args.upperBound + 1))
+
+
+def runBatchBenchmark(args):
+    """A single player, who may guess as often as they like, sends the same guesses with guessesPerMessage guesses per message."""
+    from main import GuessBot
+
+    logging.disable(logging.INFO)
+    rng = random.Random(args.seed)
+    guesses = [rng.randint(0, 100) for _ in range(args.numGuesses)]
+    for guessesPerMessage in (1, args.guessesPerMessage):
+        messages = [" ".join(map(str, guesses[i : i + guessesPerMessage])) for i in range(0, len(guesses), guessesPerMessage)]
+        with tempfile.TemporaryDirectory() as folder:
+            bot = GuessBot(openStorage("sqlite", Path(folder, "save.sqlite")), StatisticsStore(Path(folder, "statistics.sqlite")))
+            sentMessages = []
+            context = SimpleNamespace(bot=SimpleNamespace(send_message=lambda **kwargs: sentMessages.append(kwargs), delete_message=lambda **kwargs: None))
+            start = time.perf_counter()
+            for (i, text) in enumerate(messages):
+                bot.handleUpdate(makeUpdate(i, -1, 1, "player", i, text), context)
+            bot.saveQueue.flush()
+            bot.statistics.flush()
+            duration = time.perf_counter() - start
+            bot.storage.close()
+            bot.statistics.close()
+        print(
+            "{} guesses per message: {:.3f}s for {:,} guesses, {:,} replies with {:,} characters".format(
+                guessesPerMessage, duration, len(guesses), len(sentMessages), sum(len(message["text"]) for message in sentMessages)
+            )
+        )
+
+
+def runStatisticsBenchmark(args):
+    """Records games of random players in random groups and times the queries after each batch of games."""
+    rng = random.Random(args.seed)
+    numQueries = 1000
+    with tempfile.TemporaryDirectory() as folder:
+        statistics = StatisticsStore(Path(folder, "statistics.sqlite"))
+        print("{:>10} {:>14} {:>14} {:>14} {:>14}".format("games", "record (us)", "stats (us)", "leaderboard", "group board"))
+        for _ in range(args.numSteps):
+            start = time.perf_counter()
+            for _ in range(args.numGamesPerStep):
+                groupId = rng.randrange(args.numGroups)
+                playerIds = rng.sample(range(args.numPlayers), 3)
+                winner = rng.choice(playerIds)
+                results = [(playerId, "player{}".format(playerId), playerId == winner, rng.randint(0, 3)) for playerId in playerIds]
+                statistics.recordGame(groupId, results, 7)
+            recordTime = (time.perf_counter() - start) / args.numGamesPerStep
+            statsTime = timeIt(lambda: [statistics.getPlayerStatistics(rng.randrange(args.numPlayers), rng.randrange(args.numGroups)) for _ in range(numQueries)])
+            leaderboardTime = timeIt(lambda: [statistics.getLeaderboard("all") for _ in range(numQueries)])
+            groupLeaderboardTime = timeIt(lambda: [statistics.getLeaderboard("group", rng.randrange(args.numGroups)) for _ in range(numQueries)])
+            print(
+                "{:>10,} {:>14.1f} {:>14.1f} {:>14.1f} {:>14.1f}".format(
+                    statistics.getNumGames(), recordTime * 1e6, statsTime / numQueries * 1e6, leaderboardTime / numQueries * 1e6, groupLeaderboardTime / numQueries * 1e6
+                )
+            )
+        statistics.close()
+
+
+def getFakeUpdates(numChats, numUpdatesPerChat, seed):
+    """Two players per chat taking turns, each guessing a random number."""
+    rng = random.Random(seed)
+    updates = []
+    for i in range(numUpdatesPerChat):
+        for chatId in range(-numChats, 0):
+            userId = 2 * -chatId + i % 2
+            updates.append(makeUpdate(len(updates), chatId, userId, "player{}".format(userId), len(updates), str(rng.randint(0, 100))))
+    return updates
+
+
+async def runBot(bot, transport, updates, globalRate):
+    runtime = Runtime(bot, transport, outbox=Outbox(transport, globalRate=globalRate))
+    for update in updates:
+        runtime.dispatch(update)
+    await runtime.join()
+    await runtime.flush()
+    return runtime.outbox.getStats()
+
+
+def createIdleGroup(groupId, rng):
+    """A group with two players that played a few guesses, as it sits in memory between updates."""
+    from main import Group
+
+    group = Group.create(groupId)
+    for userId in (2 * groupId, 2 * groupId + 1):
+        group.getPlayer(SimpleNamespace(id=userId, first_name="player{}".format(userId)))
+    for _ in range(5):
+        group.apply({"type": "guess", "userId": group.game.turnOrder.currentPlayer.id, "x": rng.randint(0, 100)})
+    group.takePendingEvents()
+    group.game.log.clear()
+    return group
+
+
+def runMemoryBenchmark(args):
+    logging.disable(logging.INFO)
+    rng = random.Random(args.seed)
+    # Create one group first so that caches and lazily imported modules do not count
+    createIdleGroup(-1, rng)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    groups = [createIdleGroup(groupId, rng) for groupId in range(args.numGroups)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print("{:,} idle groups: {:,.0f} bytes per group".format(len(groups), size / len(groups)))
+    group = groups[0]
+    parts = [("settings", group.game.settings), ("turn orders", [group.game.turnOrder, group.game.startingPlayerTurnOrder]), ("players", group.players)]
+    for (name, part) in parts:
+        print("{:<12} {:>8,} bytes".format(name, getDeepSize(part)))
+
+
+def getDeepSize(obj, seen=None):
+    """The size of obj and everything it references, apart from classes, strings and numbers."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, (type, str, int, bool, float)) or obj is None:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(getDeepSize(k, seen) + getDeepSize(v, seen) for (k, v) in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(getDeepSize(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += getDeepSize(obj.__dict__, seen)
+    for slot in getattr(type(obj), "__slots__", ()):
+        size += getDeepSize(getattr(obj, slot, None), seen)
+    return size
+
+
+startupScript = """
+import json, logging, sys, time
+from types import SimpleNamespace
+start = time.perf_counter()
+import main
+bot = main.GuessBot()
+ready = time.perf_counter() - start
+logging.disable(logging.INFO)
+start = time.perf_counter()
+main.getNumpy()
+numpy = time.perf_counter() - start
+start = time.perf_counter()
+group = bot.getGroup(SimpleNamespace(id=int(sys.argv[1])))
+bot.processGuess(group, group.players[0], "50")
+firstUpdate = time.perf_counter() - start
+print(json.dumps(dict(main.startupTimes, ready=ready, numpy=numpy, firstUpdate=firstUpdate)))
+"""
+
+
+def runStartupBenchmark(args):
+    """Starts the bot in a fresh process on a save database with numGroups groups and handles a first guess.
+    The bot imports numpy in the background once it is ready, which is timed separately here."""
+    env = dict(os.environ, PYTHONPATH=str(Path(__file__).resolve().parent))
+    with tempfile.TemporaryDirectory() as folder:
+        storage = openStorage("sqlite", Path(folder, "save.sqlite"))
+        storage.saveMany((groupId, getGroupState(groupId)) for groupId in range(args.numGroups))
+        storage.close()
+        results = []
+        for _ in range(args.numRuns):
+            output = subprocess.run([sys.executable, "-c", startupScript, str(args.numGroups // 2)], cwd=folder, env=env, capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output))
+    print("Startup with {:,} saved groups, median of {} runs".format(args.numGroups, args.numRuns))
+    for name in results[0]:
+        print("{:<12} {:>8.1f}ms".format(name, sorted(result[name] for result in results)[len(results) // 2] * 1000))
+
+
+def runShardedBot(numShards, database, updates, args):
+    """Returns the time it took numShards worker processes to handle all updates, once they are ready."""
+    resultQueue = multiprocessing.Queue()
+    makeTransport = functools.partial(FakeTransport, args.latency, args.chatInterval)
+    (updateQueues, workers) = startWorkers(numShards, database, makeTransport, args.globalRate, resultQueue=resultQueue)
+    for _ in range(numShards):
+        resultQueue.get()
+    start = time.perf_counter()
+    dispatcher = Dispatcher(None, updateQueues)
+    for update in updates:
+        dispatcher.dispatch(update)
+    dispatcher.stop()
+    numHandledUpdates = sum(resultQueue.get()[2] for _ in range(numShards))
+    duration = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+    assert numHandledUpdates == len(updates)
+    return duration
+
+
+def runShardingBenchmark(args):
+    logging.disable(logging.INFO)
+    updates = getFakeUpdates(args.numChats, args.numUpdatesPerChat, args.seed)
+    print("{:,} updates in {:,} chats on {} cores".format(len(updates), args.numChats, os.cpu_count()))
+    print("{:>6} {:>14} {:>8}".format("shards", "updates/s", "speedup"))
+    baseline = None
+    for numShards in range(1, args.maxNumShards + 1):
+        with tempfile.TemporaryDirectory() as folder:
+            duration = runShardedBot(numShards, Path(folder, "save.sqlite"), updates, args)
+        baseline = duration if baseline is None else baseline
+        print("{:>6} {:>14,.0f} {:>8.2f}".format(numShards, len(updates) / duration, baseline / duration))
+
+
+def runRuntimeBenchmark(args):
+    from main import GuessBot
+
+    logging.disable(logging.INFO)
+    updates = getFakeUpdates(args.numChats, args.numUpdatesPerChat, args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        bot = GuessBot(openStorage("sqlite", Path(folder, "save.sqlite")), StatisticsStore(Path(folder, "statistics.sqlite")))
+        transport = FakeTransport(args.latency, args.chatInterval)
+        start = time.perf_counter()
+        outboxStats = asyncio.run(runBot(bot, transport, updates, args.globalRate))
+        duration = time.perf_counter() - start
+        bot.storage.close()
+        bot.statistics.close()
+    print("{:,} updates in {:,} chats: {:,.0f} updates/s".format(len(updates), args.numChats, len(updates) / duration))
+    print("{:,} messages sent, {:,} deleted, {:,} events and {:,} snapshots written".format(len(transport.sentMessages), len(transport.deletedMessages), bot.saveQueue.numEvents, bot.saveQueue.numSnapshots))
+    print(", ".join("{} = {:.3g}".format(k, v) for (k, v) in outboxStats.items()))
+    if args.metricsFile is not None:
+        metrics.dump(args.metricsFile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    storageParser = subparsers.add_parser("storage", help="Load and save throughput of the storage backends")
+    storageParser.add_argument("--numGroups", type=int, default=10000)
+    storageParser.set_defaults(run=runStorageBenchmark)
+    obviousRootParser = subparsers.add_parser("obviousRoots", help="Obvious root detection after every guess")
+    obviousRootParser.add_argument("--numRoots", type=int, default=9)
+    obviousRootParser.add_argument("--upperBound", type=int, default=100000)
+    obviousRootParser.add_argument("--numGuesses", type=int, default=3000)
+    obviousRootParser.add_argument("--seed", type=int, default=0)
+    obviousRootParser.set_defaults(run=runObviousRootBenchmark)
+    recapParser = subparsers.add_parser("recap", help="Producing the recap after every guess")
+    recapParser.add_argument("--numRoots", type=int, default=30)
+    recapParser.add_argument("--upperBound", type=int, default=1000000)
+    recapParser.add_argument("--numGuesses", type=int, default=1000)
+    recapParser.add_argument("--seed", type=int, default=0)
+    recapParser.set_defaults(run=runRecapBenchmark)
+    solverParser = subparsers.add_parser("solver", help="Forced roots found by the solver compared to the obvious roots")
+    solverParser.add_argument("--numGames", type=int, default=100)
+    solverParser.add_argument("--numRoots", type=int, default=9)
+    solverParser.add_argument("--upperBound", type=int, default=100000)
+    solverParser.add_argument("--numGuesses", type=int, default=50)
+    solverParser.add_argument("--seed", type=int, default=0)
+    solverParser.set_defaults(run=runSolverBenchmark)
+    memoryParser = subparsers.add_parser("memory", help="Bytes per idle group in memory")
+    memoryParser.add_argument("--numGroups", type=int, default=10000)
+    memoryParser.add_argument("--seed", type=int, default=0)
+    memoryParser.set_defaults(run=runMemoryBenchmark)
+    startupParser = subparsers.add_parser("startup", help="Time until the bot is ready and until it answered its first update")
+    startupParser.add_argument("--numGroups", type=int, default=10000)
+    startupParser.add_argument("--numRuns", type=int, default=5)
+    startupParser.set_defaults(run=runStartupBenchmark)
+    shardingParser = subparsers.add_parser("sharding", help="Updates per second of the bot sharded over 1 to maxNumShards processes")
+    shardingParser.add_argument("--maxNumShards", type=int, default=os.cpu_count())
+    shardingParser.add_argument("--numChats", type=int, default=1000)
+    shardingParser.add_argument("--numUpdatesPerChat", type=int, default=20)
+    shardingParser.add_argument("--latency", type=float, default=0.0, help="Seconds per call to the fake Telegram API")
+    shardingParser.add_argument("--chatInterval", type=float, default=0.0, help="Minimum seconds between messages to a chat before the fake API refuses them")
+    shardingParser.add_argument("--globalRate", type=float, default=1e6, help="Messages per second the outboxes of all shards send in total")
+    shardingParser.add_argument("--seed", type=int, default=0)
+    shardingParser.set_defaults(run=runShardingBenchmark)
+    batchParser = subparsers.add_parser("batch", help="Handling guesses one per message compared to several per message")
+    batchParser.add_argument("--numGuesses", type=int, default=20000)
+    batchParser.add_argument("--guessesPerMessage", type=int, default=4)
+    batchParser.add_argument("--seed", type=int, default=0)
+    batchParser.set_defaults(run=runBatchBenchmark)
+    statisticsParser = subparsers.add_parser("statistics", help="Time to record a game and to answer /stats and /leaderboard as the number of games grows")
+    statisticsParser.add_argument("--numSteps", type=int, default=4)
+    statisticsParser.add_argument("--numGamesPerStep", type=int, default=25000)
+    statisticsParser.add_argument("--numGroups", type=int, default=1000)
+    statisticsParser.add_argument("--numPlayers", type=int, default=3000)
+    statisticsParser.add_argument("--seed", type=int, default=0)
+    statisticsParser.set_defaults(run=runStatisticsBenchmark)
+    runtimeParser = subparsers.add_parser("runtime", help="Updates per second of the whole bot on a fake Telegram transport")
+    runtimeParser.add_argument("--numChats", type=int, default=1000)
+    runtimeParser.add_argument("--numUpdatesPerChat", type=int, default=20)
+    runtimeParser.add_argument("--latency", type=float, default=0.01, help="Seconds per call to the fake Telegram API")
+    runtimeParser.add_argument("--chatInterval", type=float, default=1.0, help="Minimum seconds between messages to a chat before the fake API refuses them")
+    runtimeParser.add_argument("--globalRate", type=float, default=1000.0, help="Messages per second the outbox sends in total")
+    runtimeParser.add_argument("--seed", type=int, default=0)
+    runtimeParser.add_argument("--metricsFile", default=None, help="Write the collected metrics to this file")
+    runtimeParser.set_defaults(run=runRuntimeBenchmark)
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
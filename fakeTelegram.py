@@ -0,0 +1,155 @@
+"""A local stand-in for the Telegram Bot API that serves the methods the bot uses: getUpdates,
+sendMessage and deleteMessage. Start the bot with --apiUrl http://localhost:PORT/bot to use it.
+loadTest.py uses it to run the bot against simulated group chats."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+import heapq
+import json
+import math
+import threading
+import time
+
+botUser = {"id": 1, "is_bot": True, "first_name": "GuessBot", "username": "GuessBot"}
+
+
+class TooManyRequests(Exception):
+    def __init__(self, retryAfter):
+        super().__init__("Too Many Requests: retry after {}".format(retryAfter))
+        self.retryAfter = retryAfter
+
+
+class FakeTelegram:
+    """The state of the fake API. Updates are scheduled for a time and getUpdates delivers them once it has
+    passed. Unlike Telegram, an update is forgotten once it was delivered instead of when a later offset
+    confirms it. Like Telegram, messages to a chat that are sent less than chatInterval seconds apart are
+    refused. Listeners are called with the chat id, the text and the time of every message the bot sends."""
+
+    def __init__(self, chatInterval=0.0):
+        self.chatInterval = chatInterval
+        self.condition = threading.Condition()
+        self.scheduledUpdates = []
+        self.nextUpdateId = 1
+        self.nextMessageId = 1
+        self.lastMessageTimes = {}
+        self.listeners = []
+        self.numPolls = 0
+        self.numDeliveredUpdates = 0
+        self.numSentMessages = 0
+        self.numDeletedMessages = 0
+        self.numRefusedMessages = 0
+
+    def addUpdate(self, chatId, userId, firstName, text, deliveryTime=None):
+        """Schedule a message of a user in a group chat. Returns its message id."""
+        deliveryTime = time.monotonic() if deliveryTime is None else deliveryTime
+        with self.condition:
+            (updateId, messageId) = (self.nextUpdateId, self.nextMessageId)
+            self.nextUpdateId += 1
+            self.nextMessageId += 1
+            message = {
+                "message_id": messageId,
+                "date": int(time.time()),
+                "chat": {"id": chatId, "type": "group", "title": "Chat {}".format(chatId)},
+                "from": {"id": userId, "is_bot": False, "first_name": firstName},
+                "text": text,
+            }
+            heapq.heappush(self.scheduledUpdates, (deliveryTime, updateId, {"update_id": updateId, "message": message}))
+            self.condition.notify_all()
+        return messageId
+
+    def getUpdates(self, offset=None, timeout=0, limit=100):
+        deadline = time.monotonic() + float(timeout)
+        with self.condition:
+            self.numPolls += 1
+            while True:
+                now = time.monotonic()
+                updates = []
+                while len(self.scheduledUpdates) > 0 and self.scheduledUpdates[0][0] <= now and len(updates) < int(limit):
+                    updates.append(heapq.heappop(self.scheduledUpdates)[2])
+                if len(updates) > 0 or now >= deadline:
+                    self.numDeliveredUpdates += len(updates)
+                    return updates
+                waitTime = deadline - now
+                if len(self.scheduledUpdates) > 0:
+                    waitTime = min(waitTime, self.scheduledUpdates[0][0] - now)
+                self.condition.wait(waitTime)
+
+    def sendMessage(self, chat_id, text, parse_mode=None, **kwargs):
+        chatId = int(chat_id)
+        with self.condition:
+            now = time.monotonic()
+            timeSinceLastMessage = now - self.lastMessageTimes.get(chatId, float("-inf"))
+            if timeSinceLastMessage < self.chatInterval:
+                self.numRefusedMessages += 1
+                raise TooManyRequests(math.ceil(self.chatInterval - timeSinceLastMessage))
+            self.lastMessageTimes[chatId] = now
+            self.numSentMessages += 1
+            messageId = self.nextMessageId
+            self.nextMessageId += 1
+        for listener in self.listeners:
+            listener(chatId, text, now)
+        return {"message_id": messageId, "date": int(time.time()), "chat": {"id": chatId, "type": "group"}, "from": botUser, "text": text}
+
+    def deleteMessage(self, chat_id, message_id, **kwargs):
+        with self.condition:
+            self.numDeletedMessages += 1
+        return True
+
+    def getMe(self, **kwargs):
+        return botUser
+
+    def call(self, method, parameters):
+        function = {"getUpdates": self.getUpdates, "sendMessage": self.sendMessage, "deleteMessage": self.deleteMessage, "getMe": self.getMe}.get(method)
+        if function is None:
+            return (404, {"ok": False, "error_code": 404, "description": "Not Found: method {}".format(method)})
+        try:
+            return (200, {"ok": True, "result": function(**parameters)})
+        except TooManyRequests as e:
+            return (429, {"ok": False, "error_code": 429, "description": str(e), "parameters": {"retry_after": e.retryAfter}})
+
+    def getStats(self):
+        with self.condition:
+            return {
+                "numPolls": self.numPolls,
+                "numDeliveredUpdates": self.numDeliveredUpdates,
+                "numScheduledUpdates": len(self.scheduledUpdates),
+                "numSentMessages": self.numSentMessages,
+                "numDeletedMessages": self.numDeletedMessages,
+                "numRefusedMessages": self.numRefusedMessages,
+            }
+
+
+def startServer(api, port=0):
+    """Serve api on http://localhost:port/bot<token>/<method> in a background thread. Returns the server, whose
+    server_port is the actual port if port is 0."""
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep connections alive like the real API, python-telegram-bot reuses them
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            parameters = dict(parse_qsl(url.query))
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if len(body) > 0:
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    parameters.update(json.loads(body))
+                else:
+                    parameters.update(parse_qsl(body.decode()))
+            (status, response) = api.call(url.path.rsplit("/", 1)[-1], parameters)
+            content = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("localhost", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="FakeTelegram", daemon=True).start()
+    return server
@@ -1,12 +1,45 @@
+from array import array
+import bisect
 import random
 
+# Imported on first use, since importing numpy takes longer than the rest of the startup of the bot
+numpy = None
+numpyIsAvailable = True
+
+maxInt64 = 2**63 - 1
+# Larger domains are not tabulated, their values are computed on demand instead
+maxNumTabulatedValues = 10001
+
+
+def getNumpy():
+    global numpy, numpyIsAvailable
+    if numpy is None and numpyIsAvailable:
+        try:
+            import numpy
+        except ImportError:
+            numpyIsAvailable = False
+    return numpy
+
 
 class Function:
-    def __init__(self, numRoots):
-        self.lowerBound = 0
-        self.upperBound = 100
-        self.roots = sorted([random.randint(self.lowerBound, self.upperBound) for i in range(numRoots)])
+    __slots__ = ("lowerBound", "upperBound", "roots", "rootSet", "prefactor", "values", "cachedValues")
+
+    def __init__(self, numRoots, lowerBound=0, upperBound=100, roots=None, rng=random):
+        self.lowerBound = lowerBound
+        self.upperBound = upperBound
+        if roots is None:
+            roots = [rng.randint(self.lowerBound, self.upperBound) for i in range(numRoots)]
+        self.roots = sorted(roots)
+        self.rootSet = set(self.roots)
         self.prefactor = 1
+        if self.upperBound - self.lowerBound < maxNumTabulatedValues:
+            self.values = self.evaluateMany(range(self.lowerBound, self.upperBound + 1))
+            # Machine integers take a fraction of the memory of python integers
+            if self.fitsInInt64(self.lowerBound, self.upperBound):
+                self.values = array("q", self.values)
+        else:
+            self.values = None
+        self.cachedValues = {}
 
     def valueWithoutPrefactor(self, x):
         product = 1
@@ -15,5 +48,38 @@ class Function:
         return product
 
     def __call__(self, x):
-        poly = self.valueWithoutPrefactor(x)
-        return self.prefactor * poly
+        if self.values is not None and self.lowerBound <= x <= self.upperBound:
+            return self.values[x - self.lowerBound]
+        value = self.cachedValues.get(x)
+        if value is None:
+            value = self.prefactor * self.valueWithoutPrefactor(x)
+            self.cachedValues[x] = value
+        return value
+
+    def sign(self, x):
+        if x in self.rootSet:
+            return 0
+        # Every root above x contributes a negative factor
+        numRootsAbove = len(self.roots) - bisect.bisect_right(self.roots, x)
+        prefactorSign = 1 if self.prefactor > 0 else -1
+        return -prefactorSign if numRootsAbove % 2 == 1 else prefactorSign
+
+    def isRoot(self, x):
+        return x in self.rootSet
+
+    def evaluateMany(self, xs):
+        xs = list(xs)
+        numpy = getNumpy()
+        if numpy is not None and len(xs) > 0 and self.fitsInInt64(min(xs), max(xs)):
+            xArray = numpy.array(xs, dtype=numpy.int64)
+            product = numpy.full(len(xs), self.prefactor, dtype=numpy.int64)
+            for p in self.roots:
+                product *= xArray - p
+            return product.tolist()
+        return [self.prefactor * self.valueWithoutPrefactor(x) for x in xs]
+
+    def fitsInInt64(self, lowestX, highestX):
+        if len(self.roots) == 0:
+            return abs(self.prefactor) <= maxInt64
+        maxDistance = max(abs(highestX - self.roots[0]), abs(lowestX - self.roots[-1]))
+        return abs(self.prefactor) * maxDistance ** len(self.roots) <= maxInt64
@@ -4,12 +4,31 @@ from turnOrder import TurnOrder
 from function import Function
 from log import Log
 from gameSettings import GameSettings
+from guessTable import GuessTable
+from solver import Solver, maxNumShownCandidates
 
 
 class Game:
-    def __init__(self, players, settings=None):
+    __slots__ = (
+        "players",
+        "settings",
+        "seed",
+        "numFunctions",
+        "log",
+        "numRoots",
+        "function",
+        "rootsToGuess",
+        "guessedValues",
+        "solver",
+        "turnOrder",
+        "startingPlayerTurnOrder",
+    )
+
+    def __init__(self, players, settings=None, seed=None):
         self.players = players
         self.settings = GameSettings() if settings is None else settings
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.numFunctions = 0
         for player in self.players:
             player.numGuessedRoots = 0
         self.log = Log()
@@ -40,30 +59,44 @@ class Game:
         else:
             self.resetTurnOrder([numGuesses if player == p else numGuesses + self.settings.punishmentForGuessingInARow for p in self.players])
             self.log.write(
-                "Set the number of guesses to {} for {} and to {} for everyone else.".format(
-                    numGuesses, player, numGuesses + self.settings.punishmentForGuessingInARow
-                )
+                "Set the number of guesses to {numGuesses} for {player} and to {numGuessesOthers} for everyone else.",
+                kind="numGuesses",
+                player=player,
+                numGuesses=numGuesses,
+                numGuessesOthers=numGuesses + self.settings.punishmentForGuessingInARow,
             )
             self.showCurrentPlayer()
 
     def handlePlayerGuess(self, player, guessedNumber):
+        self.handlePlayerGuesses(player, [guessedNumber])
+
+    def handlePlayerGuesses(self, player, guessedNumbers):
+        """Make several guesses of player at once. Either all of them are valid or none is made.
+        Obvious roots are filled in and the recap is shown once, after the last guess."""
         if not self.turnOrder.isPlayersTurn(player):
             self.log.write("It is not your turn {}".format(player))
-        elif guessedNumber > self.function.upperBound:
+        elif len(guessedNumbers) > self.turnOrder.numRemainingGuesses():
+            self.log.write("You only have {} guesses remaining {}".format(self.turnOrder.numRemainingGuesses(), player))
+        elif max(guessedNumbers) > self.function.upperBound:
             self.log.write("Guess a number <= {}".format(self.function.upperBound))
-        elif guessedNumber < self.function.lowerBound:
+        elif min(guessedNumbers) < self.function.lowerBound:
             self.log.write("Guess a number >= {}".format(self.function.lowerBound))
         else:
-            self.writeGuess(guessedNumber)
-            self.guessedValues.add(guessedNumber)
-            if not self.guess(guessedNumber):
+            for guessedNumber in guessedNumbers:
+                self.writeGuess(guessedNumber)
+                self.guessedValues.add(guessedNumber)
+                if self.solver is not None:
+                    self.solver.add(guessedNumber)
+                if self.guess(guessedNumber):
+                    # The game is over, the remaining guesses would be made on the next polynomial
+                    return
                 self.nextTurn()
-                obviousRoot = self.getFirstObviousRoot()
-                if obviousRoot is not None and self.settings.autoPlay:
-                    self.printAutoplayMessage()
-                    self.handlePlayerGuess(self.turnOrder.currentPlayer, obviousRoot)
-                else:
-                    self.showRecapOrCurrentPlayer()
+            obviousRoot = self.getFirstObviousRoot()
+            if obviousRoot is not None and self.settings.autoPlay:
+                self.printAutoplayMessage()
+                self.handlePlayerGuess(self.turnOrder.currentPlayer, obviousRoot)
+            else:
+                self.showRecapOrCurrentPlayer()
 
     def getStartingPlayerName(self):
         return "{}".format(self.startingPlayer)
@@ -87,33 +120,48 @@ class Game:
         return self.startingPlayerTurnOrder.currentPlayer
 
     def printAutoplayMessage(self):
-        self.log.write("Obvious root detected!")
+        self.log.write("Obvious root detected!", kind="obviousRoot")
 
     def showRecapOrCurrentPlayer(self):
         if self.settings.autoRecap:
-            self.recap()
+            self.recap(onlyNewRows=self.settings.compactRecap)
         else:
             self.showCurrentPlayer()
 
     def getFirstObviousRoot(self):
-        sortedX = sorted(list(self.guessedValues))
-        for (x1, x2) in zip(sortedX, sortedX[1:]):
-            y1 = self.function(x1)
-            y2 = self.function(x2)
-            yHaveOppositeSigns = y1 * y2 < 0
-            if (x1 + 2 == x2) and yHaveOppositeSigns:
-                return x1 + 1
-        return None
+        obviousRoot = self.guessedValues.getFirstObviousRoot()
+        if obviousRoot is None and self.settings.autoPlaySolver:
+            return self.getSolver().getFirstForcedRoot()
+        return obviousRoot
+
+    def getSolver(self):
+        # Only built for games that use it, since it needs the exact values of all guesses
+        if self.solver is None:
+            self.solver = Solver(self.function)
+            for x in self.guessedValues:
+                self.solver.add(x)
+        return self.solver
+
+    def hint(self):
+        solver = self.getSolver()
+        self.log.write("{numCandidates:,} values can still be roots.", kind="hint", numCandidates=solver.numCandidates)
+        interval = solver.getNarrowestInterval()
+        if interval is None:
+            return
+        (start, end, candidates) = interval
+        if candidates is not None and len(candidates) <= maxNumShownCandidates:
+            self.log.write("There is a root among {candidates}", kind="hint", candidates=candidates)
+        else:
+            self.log.write("There is a root between {start} and {end}", kind="hint", start=start, end=end)
 
     def guess(self, guessedNumber):
-        result = self.function(guessedNumber)
-        if result == 0:
+        if self.function.isRoot(guessedNumber):
             return self.handleGuessedRoot(guessedNumber)
         return False
 
     def writeGuess(self, guessedNumber):
         result = self.function(guessedNumber)
-        self.log.write("{} guessed f({}) = {:,}".format(self.turnOrder.currentPlayer, guessedNumber, result))
+        self.log.write("{player} guessed f({x}) = {y:,}", kind="guess", player=self.turnOrder.currentPlayer, x=guessedNumber, y=result)
 
     def setStartingPlayer(self):
         startingPlayer = self.startingPlayerTurnOrder.getPlayerAndMakeTurn()
@@ -121,11 +169,17 @@ class Game:
         self.showCurrentPlayer()
 
     def showCurrentPlayer(self):
-        self.log.write("It's {}'s turn ({} guesses remaining, serve: {})".format(self.turnOrder.currentPlayer, self.turnOrder.numRemainingGuesses(), self.startingPlayer))
+        self.log.write(
+            "It's {player}'s turn ({numRemainingGuesses} guesses remaining, serve: {startingPlayer})",
+            kind="currentPlayer",
+            player=self.turnOrder.currentPlayer,
+            numRemainingGuesses=self.turnOrder.numRemainingGuesses(),
+            startingPlayer=self.startingPlayer,
+        )
 
     def playerRecap(self):
         for player in self.players:
-            self.log.write("{} guessed {} roots".format(player.name, player.numGuessedRoots))
+            self.log.write("{player.name} guessed {numGuessedRoots} roots", kind="playerRecap", player=player, numGuessedRoots=player.numGuessedRoots)
 
     def gameIsAlreadyWon(self):
         if len(self.players) == 1:
@@ -146,7 +200,7 @@ class Game:
 
     def handleGuessedRoot(self, guessedRoot):
         if guessedRoot in self.rootsToGuess:
-            self.log.write("That's a new root!")
+            self.log.write("That's a new root!", kind="newRoot", player=self.turnOrder.currentPlayer, x=guessedRoot)
             self.rootsToGuess.remove(guessedRoot)
             self.turnOrder.currentPlayer.numGuessedRoots += 1
             self.playerRecap()
@@ -167,9 +221,16 @@ class Game:
         maxScore = max(player.numGuessedRoots for player in self.players)
         winningPlayers = [player for player in self.players if player.numGuessedRoots == maxScore]
         for player in winningPlayers:
-            self.log.write("{} WINS HE IS AWESOME WOW".format(player))
+            self.log.write("{player} WINS HE IS AWESOME WOW", kind="winner", player=player)
             player.score += 1
-        self.log.write("Zeroes: {}".format(self.function.roots))
+        self.log.write(
+            "Zeroes: {roots}",
+            kind="gameOver",
+            roots=self.function.roots,
+            players=self.players[:],
+            winners=winningPlayers,
+            numGuessedRoots=[player.numGuessedRoots for player in self.players],
+        )
         self.showScore()
         self.setStartingPlayer()
         self.resetFunction()
@@ -177,14 +238,23 @@ class Game:
     def showScore(self):
         self.log.write("The score is: ")
         for player in self.players:
-            self.log.write("    {}: {}".format(player, player.score))
+            self.log.write("    {player}: {score}", kind="score", player=player, score=player.score)
 
     def resetFunction(self):
-        self.log.write("Creating a new polynomial with {}-{} roots.".format(self.settings.minNumRoots, self.settings.maxNumRoots))
-        self.numRoots = random.randint(self.settings.minNumRoots, self.settings.maxNumRoots)
-        self.function = Function(self.numRoots)
+        self.log.write(
+            "Creating a new polynomial with {minNumRoots}-{maxNumRoots} roots.",
+            kind="newGame",
+            minNumRoots=self.settings.minNumRoots,
+            maxNumRoots=self.settings.maxNumRoots,
+        )
+        # Every polynomial of a game is determined by the seed of the game and its number
+        rng = random.Random("{}-{}".format(self.seed, self.numFunctions))
+        self.numFunctions += 1
+        self.numRoots = rng.randint(self.settings.minNumRoots, self.settings.maxNumRoots)
+        self.function = Function(self.numRoots, self.settings.lowerBound, self.settings.upperBound, rng=rng)
         self.rootsToGuess = self.function.roots[:]
-        self.guessedValues = set()
+        self.guessedValues = GuessTable(self.function)
+        self.solver = None
         for player in self.players:
             player.numGuessedRoots = 0
 
@@ -193,18 +263,38 @@ class Game:
         for player in self.players:
             player.score = 0
 
-    def recap(self):
-        if len(self.guessedValues) > 0:
-            numberIndentation = max(len("{:,}".format(self.function(x))) for x in self.guessedValues)
-            xIndentation = max(len("{}".format(x)) for x in self.guessedValues)
-            # self.log.write("`", newline=False)
-            for guessedValue in sorted(list(self.guessedValues)):
-                self.log.write(
-                    "`f({:<{xIndentation},}) = {:>{numberIndentation},}`".format(
-                        guessedValue, self.function(guessedValue), numberIndentation=numberIndentation, xIndentation=xIndentation
-                    )
-                )
-            # self.log.write("```")
+    def getState(self):
+        return {
+            "seed": self.seed,
+            "numFunctions": self.numFunctions,
+            "lowerBound": self.function.lowerBound,
+            "upperBound": self.function.upperBound,
+            "roots": self.function.roots,
+            "rootsToGuess": self.rootsToGuess[:],
+            "guessedValues": list(self.guessedValues),
+            "numGuessedRoots": [player.numGuessedRoots for player in self.players],
+            "turnOrder": self.turnOrder.getState(),
+            "startingPlayerTurnOrder": self.startingPlayerTurnOrder.getState(),
+        }
+
+    def setState(self, state):
+        self.seed = state.get("seed", self.seed)
+        self.numFunctions = state.get("numFunctions", 1)
+        self.numRoots = len(state["roots"])
+        self.function = Function(self.numRoots, state.get("lowerBound", 0), state.get("upperBound", 100), state["roots"])
+        self.rootsToGuess = state["rootsToGuess"][:]
+        self.guessedValues = GuessTable(self.function)
+        self.solver = None
+        for x in state["guessedValues"]:
+            self.guessedValues.add(x)
+        for (player, numGuessedRoots) in zip(self.players, state["numGuessedRoots"]):
+            player.numGuessedRoots = numGuessedRoots
+        self.turnOrder = TurnOrder.fromState(self.players, state["turnOrder"])
+        self.startingPlayerTurnOrder = TurnOrder.fromState(self.players, state["startingPlayerTurnOrder"])
+
+    def recap(self, onlyNewRows=False):
+        for (x, line) in self.guessedValues.takeRecapLines(onlyNewRows):
+            self.log.write("{line}", kind="recapRow", x=x, line=line)
         self.showCurrentPlayer()
 
 
@@ -214,6 +304,7 @@ if __name__ == "__main__":
         def __init__(self, name, id_):
             self.name = name
             self.id = id_
+            self.score = 0
 
         def __repr__(self):
             return self.name
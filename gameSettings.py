@@ -1,51 +1,86 @@
-from types import SimpleNamespace
 from util import tryConvertToInt
 
+# The schema is shared by all groups, each group only stores a tuple of its values
+defaultValues = {
+    "minNumRoots": 4,
+    "maxNumRoots": 9,
+    "lowerBound": 0,
+    "upperBound": 100,
+    "numRootsToGuessDownTo": 3,
+    "minNumGuessesInARow": 1,
+    "maxNumGuessesInARow": 4,
+    "punishmentForGuessingInARow": 2,
+    "autoRecap": True,
+    "compactRecap": False,
+    "autoPlay": True,
+    "autoPlaySolver": False,
+}
+names = list(defaultValues.keys())
+indices = {k: i for (i, k) in enumerate(names)}
+helpTexts = {
+    "minNumRoots": "The minimum number of roots that a new game will be initialized with.",
+    "maxNumRoots": "The maximum number of roots that a new game will be initialized with.",
+    "lowerBound": "The smallest value that can be guessed (and the smallest possible root) in a new game.",
+    "upperBound": "The largest value that can be guessed (and the largest possible root) in a new game.",
+    "numRootsToGuessDownTo": "The number of remaining roots at which the score for the current polynomial is evaluated",
+    "minNumGuessesInARow": "The minimum (and default) number of guesses a player has",
+    "maxNumGuessesInARow": "The maximum number of guesses the starting player can give himself (by typing #N, where N is the number of guesses).",
+    "punishmentForGuessingInARow": "How many more guesses players after the starting player have if the starting player increased his number of guesses in a round",
+    "autoRecap": "Whether to show a recap of the game automatically after guessing",
+    "compactRecap": "Whether the automatic recap only shows the values guessed since the last recap",
+    "autoPlay": "Whether to fill in obvious roots (a single hole between two guessed values that show a sign change) automatically",
+    "autoPlaySolver": "Whether autoPlay also fills in roots that are forced by the sign changes and the divisibility of the guessed values",
+}
+defaultValueTuple = tuple(defaultValues.values())
+
+
+class GameSettings:
+    __slots__ = ("values",)
 
-class GameSettings(SimpleNamespace):
     def __init__(self):
-        values = {
-            "minNumRoots": 4,
-            "maxNumRoots": 9,
-            "numRootsToGuessDownTo": 3,
-            "minNumGuessesInARow": 1,
-            "maxNumGuessesInARow": 4,
-            "punishmentForGuessingInARow": 2,
-            "autoRecap": True,
-            "autoPlay": True,
-        }
-        super().__init__(**values)
-        self.names = list(values.keys())
-        self.helpTexts = {
-            "minNumRoots": "The minimum number of roots that a new game will be initialized with.",
-            "maxNumRoots": "The maximum number of roots that a new game will be initialized with.",
-            "numRootsToGuessDownTo": "The number of remaining roots at which the score for the current polynomial is evaluated",
-            "minNumGuessesInARow": "The minimum (and default) number of guesses a player has",
-            "maxNumGuessesInARow": "The maximum number of guesses the starting player can give himself (by typing #N, where N is the number of guesses).",
-            "punishmentForGuessingInARow": "How many more guesses players after the starting player have if the starting player increased his number of guesses in a round",
-            "autoRecap": "Whether to show a recap of the game automatically after guessing",
-            "autoPlay": "Whether to fill in obvious roots (a single hole between two guessed values that show a sign change) automatically",
-        }
+        # Groups that never changed a setting all share the same tuple
+        self.values = defaultValueTuple
 
     def iterVariables(self):
-        for k in self.names:
-            yield (k, self.__dict__[k])
+        return zip(names, self.values)
 
     def showHelp(self):
-        return "\n".join("{}: {}".format(k, self.helpTexts[k]) for (k, _) in self.iterVariables())
+        return "\n".join("{}: {}".format(k, helpTexts[k]) for k in names)
 
     def set(self, k, vString):
-        if not k in self.names:
+        if not k in indices:
             return "Parameter does not exist: {}".format(k)
         v = tryConvertToInt(vString)
         if v is None:
             return "Invalid value: {}".format(vString)
         else:
-            if type(self.__dict__[k]) == bool:
+            if type(defaultValues[k]) == bool:
                 v = bool(v)
-            self.__dict__[k] = v
+            previousValues = self.values
+            self.setValue(k, v)
+            if self.minNumRoots > self.maxNumRoots or self.lowerBound > self.upperBound:
+                self.values = previousValues
+                return "Invalid value: {} (minimum must not be larger than maximum)".format(vString)
             return "Set {} to {}.".format(k, v)
 
-    def update(self, settings):
-        for (k, v) in settings.iterVariables():
-            self.__dict__[k] = v
+    def setValue(self, k, v):
+        values = list(self.values)
+        values[indices[k]] = v
+        self.values = defaultValueTuple if values == list(defaultValueTuple) else tuple(values)
+
+    def update(self, values):
+        for (k, v) in values.items():
+            if k in indices:
+                self.setValue(k, v)
+        return self
+
+    def getState(self):
+        return dict(self.iterVariables())
+
+
+def makeGetter(index):
+    return property(lambda self: self.values[index])
+
+
+for (index, name) in enumerate(names):
+    setattr(GameSettings, name, makeGetter(index))
@@ -0,0 +1,47 @@
+from collections import OrderedDict
+import logging
+from metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+defaultMaxNumLoadedGroups = 1000
+
+
+class GroupRegistry:
+    """Groups indexed by chat id. The least recently used groups are written to disk and dropped once
+    more than maxNumLoadedGroups are in memory; they are loaded again on their next update."""
+
+    def __init__(self, loadGroup, saveGroup, maxNumLoadedGroups=defaultMaxNumLoadedGroups):
+        self.loadGroup = loadGroup
+        self.saveGroup = saveGroup
+        self.maxNumLoadedGroups = maxNumLoadedGroups
+        self.groups = OrderedDict()
+
+    def get(self, chat):
+        group = self.groups.get(chat.id)
+        if group is None:
+            metrics.increment("groupCacheMisses")
+            with metrics.time("loadGroup"):
+                group = self.loadGroup(chat)
+            logger.info("Registering group {}".format(group.id))
+            self.groups[chat.id] = group
+            self.evictIdleGroups()
+        else:
+            self.groups.move_to_end(chat.id)
+        return group
+
+    def evictIdleGroups(self):
+        while len(self.groups) > self.maxNumLoadedGroups:
+            (_, group) = self.groups.popitem(last=False)
+            logger.info("Evicting idle group {}".format(group.id))
+            metrics.increment("groupEvictions")
+            self.saveGroup(group)
+
+    def __contains__(self, chatId):
+        return chatId in self.groups
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __iter__(self):
+        return iter(self.groups.values())
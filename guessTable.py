@@ -0,0 +1,85 @@
+import bisect
+
+
+class GuessTable:
+    """The guessed values of a game in sorted order, along with the sign of the function at each of them.
+    Keeps track of the obvious roots: values that have not been guessed yet while both of their neighbours
+    have been guessed and show a sign change.
+    The rows of the recap are formatted only once per guessed value and the column widths are kept up to date.
+    Padded recap lines are cached until the column widths change."""
+
+    __slots__ = ("function", "values", "signs", "obviousRoots", "formattedRows", "unformattedValues", "valuesSinceLastRecap", "xWidth", "yWidth", "recapLines")
+
+    def __init__(self, function):
+        self.function = function
+        self.values = []
+        self.signs = {}
+        self.obviousRoots = []
+        self.formattedRows = {}
+        self.unformattedValues = []
+        self.valuesSinceLastRecap = []
+        self.xWidth = 0
+        self.yWidth = 0
+        self.recapLines = {}
+
+    def add(self, x):
+        if x in self.signs:
+            return
+        bisect.insort(self.values, x)
+        self.signs[x] = self.function.sign(x)
+        self.unformattedValues.append(x)
+        self.valuesSinceLastRecap.append(x)
+        self.removeObviousRoot(x)
+        for neighbour in (x - 1, x + 1):
+            if self.isObviousRoot(neighbour):
+                bisect.insort(self.obviousRoots, neighbour)
+
+    def isObviousRoot(self, x):
+        return x not in self.signs and self.signs.get(x - 1, 0) * self.signs.get(x + 1, 0) < 0
+
+    def removeObviousRoot(self, x):
+        index = bisect.bisect_left(self.obviousRoots, x)
+        if index < len(self.obviousRoots) and self.obviousRoots[index] == x:
+            del self.obviousRoots[index]
+
+    def getFirstObviousRoot(self):
+        if len(self.obviousRoots) == 0:
+            return None
+        return self.obviousRoots[0]
+
+    def formatNewRows(self):
+        # Exact values are only computed here, since the recap is the only place that shows all of them
+        widths = (self.xWidth, self.yWidth)
+        for x in self.unformattedValues:
+            row = ("{:,}".format(x), "{:,}".format(self.function(x)))
+            self.formattedRows[x] = row
+            self.xWidth = max(self.xWidth, len(row[0]))
+            self.yWidth = max(self.yWidth, len(row[1]))
+        self.unformattedValues = []
+        if widths != (self.xWidth, self.yWidth):
+            self.recapLines = {}
+
+    def getRecapLine(self, x):
+        line = self.recapLines.get(x)
+        if line is None:
+            (xText, yText) = self.formattedRows[x]
+            line = "`f({:<{xWidth}}) = {:>{yWidth}}`".format(xText, yText, xWidth=self.xWidth, yWidth=self.yWidth)
+            self.recapLines[x] = line
+        return line
+
+    def takeRecapLines(self, onlyNewRows=False):
+        """The (x, line) pairs of the recap. If onlyNewRows is set, only those of the values that were guessed
+        since the last recap."""
+        self.formatNewRows()
+        values = sorted(self.valuesSinceLastRecap) if onlyNewRows else self.values
+        self.valuesSinceLastRecap = []
+        return [(x, self.getRecapLine(x)) for x in values]
+
+    def __contains__(self, x):
+        return x in self.signs
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""End-to-end load test. Runs main.py against a local fake Telegram server with thousands of simulated group
+chats and reports the updates per second, the reply latency and the rate at which the bot writes to disk.
+With --resultsFile the results are appended to a file, one JSON object per run, to compare versions."""
+
+from collections import deque
+from pathlib import Path
+import argparse
+import datetime
+import json
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from fakeTelegram import FakeTelegram, startServer
+
+turnPattern = re.compile(r"It's (.+?)'s turn")
+commands = ["/score", "/recap", "/roots", "/hint", "/stats", "/leaderboard"]
+
+
+class SimulatedChat:
+    def __init__(self, chatId, playerIds):
+        self.id = chatId
+        self.playerIds = playerIds
+        self.playerIdsByName = {getPlayerName(playerId): playerId for playerId in playerIds}
+        self.numJoinedPlayers = 0
+        self.currentPlayer = None
+        self.pendingTimes = deque()
+
+
+def getPlayerName(playerId):
+    return "p{}".format(playerId)
+
+
+class LoadGenerator:
+    """Players join their chat one after another and then guess whenever the bot says it is their turn,
+    after thinking for thinkTime seconds on average. Now and then they use a command, set the number
+    of guesses or send several guesses at once. The latency of an update is the time until the bot
+    sends the next message to its chat."""
+
+    def __init__(self, api, numChats, numPlayersPerChat=2, thinkTime=1.0, seed=0):
+        self.api = api
+        self.thinkTime = thinkTime
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.chats = {}
+        for i in range(numChats):
+            chatId = -(i + 1)
+            self.chats[chatId] = SimulatedChat(chatId, [numPlayersPerChat * i + j + 1 for j in range(numPlayersPerChat)])
+        self.latencies = []
+        self.numAnsweredUpdates = 0
+        self.numLostUpdates = 0
+        api.listeners.append(self.onMessage)
+
+    def start(self):
+        with self.lock:
+            now = time.monotonic()
+            for chat in self.chats.values():
+                self.sendNextMessage(chat, now)
+
+    def resetCounters(self):
+        with self.lock:
+            self.latencies = []
+            self.numAnsweredUpdates = 0
+            self.numLostUpdates = 0
+
+    def onMessage(self, chatId, text, now):
+        with self.lock:
+            chat = self.chats.get(chatId)
+            if chat is None:
+                return
+            turns = turnPattern.findall(text)
+            if len(turns) > 0:
+                chat.currentPlayer = turns[-1]
+            # Further chunks of a reply that was already counted
+            if len(chat.pendingTimes) == 0:
+                return
+            self.latencies.extend(now - pendingTime for pendingTime in chat.pendingTimes)
+            self.numAnsweredUpdates += len(chat.pendingTimes)
+            chat.pendingTimes.clear()
+            self.sendNextMessage(chat, now)
+
+    def restartStalledChats(self, timeout):
+        """Chats whose last update was not answered within timeout seconds continue with a new message."""
+        with self.lock:
+            now = time.monotonic()
+            for chat in self.chats.values():
+                if len(chat.pendingTimes) > 0 and now - chat.pendingTimes[0] > timeout:
+                    self.numLostUpdates += len(chat.pendingTimes)
+                    chat.pendingTimes.clear()
+                    self.sendNextMessage(chat, now)
+
+    def sendNextMessage(self, chat, now):
+        if chat.numJoinedPlayers < len(chat.playerIds):
+            playerId = chat.playerIds[chat.numJoinedPlayers]
+            chat.numJoinedPlayers += 1
+            text = str(self.rng.randint(0, 100))
+        else:
+            playerId = chat.playerIdsByName.get(chat.currentPlayer, self.rng.choice(chat.playerIds))
+            text = self.chooseMessage()
+        deliveryTime = now + (self.rng.expovariate(1 / self.thinkTime) if self.thinkTime > 0 else 0)
+        self.api.addUpdate(chat.id, playerId, getPlayerName(playerId), text, deliveryTime)
+        chat.pendingTimes.append(deliveryTime)
+
+    def chooseMessage(self):
+        r = self.rng.random()
+        if r < 0.03:
+            return self.rng.choice(commands)
+        elif r < 0.08:
+            return "#{}".format(self.rng.randint(2, 4))
+        elif r < 0.18:
+            return ", ".join(str(self.rng.randint(0, 100)) for _ in range(self.rng.randint(2, 3)))
+        return str(self.rng.randint(0, 100))
+
+
+def getProcessTree(pid):
+    pids = [pid]
+    for task in Path("/proc/{}/task".format(pid)).glob("*"):
+        childrenPath = Path(task, "children")
+        if childrenPath.is_file():
+            for child in childrenPath.read_text().split():
+                pids.extend(getProcessTree(int(child)))
+    return pids
+
+
+def getWriteBytes(pids):
+    """The number of bytes the processes caused to be written to disk so far, or None where /proc is not available."""
+    total = 0
+    for pid in pids:
+        try:
+            lines = Path("/proc/{}/io".format(pid)).read_text().splitlines()
+        except OSError:
+            return None
+        total += int(dict(line.split(": ") for line in lines)["write_bytes"])
+    return total
+
+
+def getPercentile(values, percentile):
+    if len(values) == 0:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def getRevision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def startBot(folder, apiUrl, args):
+    Path(folder, "apiToken").write_text("123456:loadTest\n")
+    command = [sys.executable, str(Path(__file__).resolve().parent / "main.py"), "--apiUrl", apiUrl, "--metricsFile", "metrics.json", "--numShards", str(args.numShards), "--globalRate", str(args.globalRate)]
+    with Path(folder, "bot.log").open("w") as log:
+        return subprocess.Popen(command, cwd=folder, stdout=log, stderr=subprocess.STDOUT)
+
+
+def waitUntilPolling(api, process, folder, timeout=60):
+    start = time.monotonic()
+    while api.getStats()["numPolls"] == 0:
+        if process.poll() is not None or time.monotonic() - start > timeout:
+            process.kill()
+            sys.exit("The bot did not start:\n" + Path(folder, "bot.log").read_text()[-3000:])
+        time.sleep(0.01)
+    return time.monotonic() - start
+
+
+def runLoadTest(args):
+    api = FakeTelegram(args.chatInterval)
+    server = startServer(api)
+    apiUrl = "http://localhost:{}/bot".format(server.server_port)
+    with tempfile.TemporaryDirectory() as folder:
+        process = startBot(folder, apiUrl, args)
+        startupTime = waitUntilPolling(api, process, folder)
+        generator = LoadGenerator(api, args.numChats, args.numPlayersPerChat, args.thinkTime, args.seed)
+        generator.start()
+        time.sleep(args.warmup)
+        generator.resetCounters()
+        pids = getProcessTree(process.pid)
+        writeBytesAtStart = getWriteBytes(pids)
+        start = time.monotonic()
+        while time.monotonic() - start < args.duration:
+            time.sleep(min(1.0, args.duration - (time.monotonic() - start)))
+            generator.restartStalledChats(args.replyTimeout)
+        duration = time.monotonic() - start
+        writeBytes = getWriteBytes(pids)
+        with generator.lock:
+            latencies = generator.latencies[:]
+            (numAnsweredUpdates, numLostUpdates) = (generator.numAnsweredUpdates, generator.numLostUpdates)
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=120)
+    server.shutdown()
+    return {
+        "revision": getRevision(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "numChats": args.numChats,
+        "numPlayersPerChat": args.numPlayersPerChat,
+        "thinkTime": args.thinkTime,
+        "chatInterval": args.chatInterval,
+        "numShards": args.numShards,
+        "globalRate": args.globalRate,
+        "duration": duration,
+        "startupTime": startupTime,
+        "updatesPerSecond": numAnsweredUpdates / duration,
+        "latencyP50": getPercentile(latencies, 50),
+        "latencyP99": getPercentile(latencies, 99),
+        "diskWriteBytesPerSecond": None if writeBytes is None or writeBytesAtStart is None else (writeBytes - writeBytesAtStart) / duration,
+        "numLostUpdates": numLostUpdates,
+        "numRefusedMessages": api.getStats()["numRefusedMessages"],
+    }
+
+
+def printResults(results):
+    print("{:,} chats, {} shards: ready after {:.2f}s".format(results["numChats"], results["numShards"], results["startupTime"]))
+    print("{:,.0f} updates/s, reply latency p50 = {:.3f}s, p99 = {:.3f}s".format(results["updatesPerSecond"], results["latencyP50"], results["latencyP99"]))
+    if results["diskWriteBytesPerSecond"] is not None:
+        print("disk writes: {:,.0f} KB/s".format(results["diskWriteBytesPerSecond"] / 1024))
+    print("{:,} updates without reply, {:,} messages refused by the rate limit".format(results["numLostUpdates"], results["numRefusedMessages"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--numChats", type=int, default=1000)
+    parser.add_argument("--numPlayersPerChat", type=int, default=2)
+    parser.add_argument("--thinkTime", type=float, default=2.0, help="Average seconds a player waits after the bot's reply before sending the next message")
+    parser.add_argument("--chatInterval", type=float, default=1.0, help="Minimum seconds between messages to a chat before the fake API refuses them")
+    parser.add_argument("--globalRate", type=float, default=10000.0, help="Messages per second the bot may send in total. Telegram allows about 30, which caps the throughput")
+    parser.add_argument("--numShards", type=int, default=1)
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds to run before measuring")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to measure")
+    parser.add_argument("--replyTimeout", type=float, default=30.0, help="Seconds after which an update counts as lost")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--resultsFile", default=None, help="Append the results to this file as one line of JSON")
+    args = parser.parse_args()
+    results = runLoadTest(args)
+    printResults(results)
+    if args.resultsFile is not None:
+        with open(args.resultsFile, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
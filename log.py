@@ -1,11 +1,61 @@
+from collections import namedtuple
+
+telegramMaxMessageLength = 4096
+truncationMarker = "\n[...]"
+
+LogEvent = namedtuple("LogEvent", ["kind", "text", "data", "newline"])
+
+
+def render(event):
+    text = event.text.format(**event.data) if len(event.data) > 0 else event.text
+    return text + ("\n" if event.newline else "")
+
+
 class Log:
+    """Collects the events of a game until they are dumped. An event has a kind and the data it was written
+    with (e.g. the player, x and f(x) of a guess), which are only formatted into text when dumping."""
+
     def __init__(self):
-        self.content = ""
+        self.events = []
+
+    def write(self, text, newline=True, kind="text", **data):
+        self.events.append(LogEvent(kind, text, data, newline))
 
-    def write(self, text, newline=True):
-        self.content = self.content + text + ("\n" if newline else "")
+    def iterEvents(self, kind=None):
+        return (event for event in self.events if kind is None or event.kind == kind)
 
-    def dump(self):
-        buf = self.content
-        self.content = ""
+    def clear(self):
+        self.events = []
+
+    def dump(self, maxLength=None):
+        buf = "".join(render(event) for event in self.events)
+        self.events = []
+        if maxLength is not None and len(buf) > maxLength:
+            buf = buf[: maxLength - len(truncationMarker)] + truncationMarker
         return buf
+
+    def dumpChunks(self, maxLength=telegramMaxMessageLength):
+        """Split the rendered events into chunks of at most maxLength characters without splitting lines where possible."""
+        chunks = []
+        chunk = []
+        chunkLength = 0
+        for event in self.events:
+            text = render(event)
+            if len(text) > maxLength and chunkLength > 0:
+                # Keep the order: the pending lines go out before the pieces of the long line
+                chunks.append("".join(chunk))
+                chunk = []
+                chunkLength = 0
+            while len(text) > maxLength:
+                chunks.append(text[:maxLength])
+                text = text[maxLength:]
+            if chunkLength + len(text) > maxLength:
+                chunks.append("".join(chunk))
+                chunk = []
+                chunkLength = 0
+            chunk.append(text)
+            chunkLength += len(text)
+        if chunkLength > 0:
+            chunks.append("".join(chunk))
+        self.events = []
+        return chunks
@@ -1,123 +1,310 @@
-from game import Game
-
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
+import time
 
-from pathlib import Path
+importStart = time.perf_counter()
+
+from game import Game
+from contextlib import contextmanager
+from types import SimpleNamespace
+import argparse
+import functools
 import logging
-import yaml
-from util import tryConvertToInt
+import random
+import threading
+from util import tryConvertToInt, tryConvertToInts
 from gameSettings import GameSettings
+from groupRegistry import GroupRegistry
+from saveQueue import SaveQueue
+from storage import SqliteStorage
+from playerStatistics import StatisticsStore, formatLeaderboard, formatTotals, periods
+from runtime import Runtime, runUntilInterrupted
+from outbox import Outbox, defaultGlobalRate
+from transport import TelegramTransport
+from metrics import registry as metrics
+from profiler import SamplingProfiler
+from function import getNumpy
+from sharding import rebalance, runSharded
+
+startupTimes = {"imports": time.perf_counter() - importStart}
 
 # Enable logging
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 
 logger = logging.getLogger(__name__)
 
-saveFolder = "save"
+saveDatabase = "save.sqlite"
+statisticsDatabase = "statistics.sqlite"
 
 numGuessSettingIdentifierString = "#"
 
+groupChatTypes = ["group", "supergroup"]
 
-def findById(objectWithId, listOfObjects, constructor):
-    for obj in listOfObjects:
-        if objectWithId.id == obj.id:
-            return obj
-    return constructor(objectWithId)
 
+@contextmanager
+def startupPhase(name):
+    start = time.perf_counter()
+    yield
+    startupTimes[name] = time.perf_counter() - start
 
-def getNewGroup(chat):
-    saveFile = getSaveFileName(chat)
-    if saveFile.is_file():
-        with saveFile.open("r") as f:
-            result = yaml.load(f, Loader=yaml.UnsafeLoader)
-            if result is None:
-                return None
-            print("Found group in save file", result)
-            return Group(*result)
-    else:
-        return Group(chat.id)
+
+def readToken():
+    with open("apiToken", "r") as f:
+        return f.readlines()[0].replace("\n", "")
 
 
-def getSaveFileName(group):
-    path = Path(saveFolder, str(group.id))
-    if not path.is_file():
-        path.parent.mkdir(exist_ok=True)
-    return path
+def loadGroup(storage, savedGroupIds, chat, saveQueue=None):
+    """Groups are only looked up in the storage if they are in the index of saved groups that is built at startup."""
+    if chat.id not in savedGroupIds:
+        savedGroupIds.add(chat.id)
+        return Group.create(chat.id)
+    if saveQueue is not None:
+        # The group may have been evicted while its last changes are still being written
+        saveQueue.waitUntilWritten(chat.id)
+    state = storage.load(chat.id)
+    group = None if state is None else Group.fromState(state)
+    events = storage.loadEvents(chat.id, 0 if group is None else group.numEvents)
+    if len(events) > 0:
+        group = Group.replay(chat.id, events, group)
+    if group is None:
+        return Group.create(chat.id)
+    logger.info("Found group {} in save file".format(chat.id))
+    return group
 
 
 class Player:
+    __slots__ = ("id", "name", "score", "numGuessedRoots")
+
     def __init__(self, user):
         self.id = user.id
         self.name = user.first_name
+        self.score = 0
+
+    def getState(self):
+        return {"id": self.id, "name": self.name, "score": self.score}
+
+    @staticmethod
+    def fromState(state):
+        player = Player(SimpleNamespace(id=state["id"], first_name=state["name"]))
+        player.score = state["score"]
+        return player
 
     def __repr__(self):
         return self.name
 
 
 class Group:
-    def __init__(self, _id, players=None, settings=None):
+    """Everything that changes the state of a group goes through apply, which records the event in the
+    group's event log. Replaying the event log from the creation of the group reproduces its state exactly,
+    since all random numbers are derived from the seed of the group."""
+
+    __slots__ = ("id", "seed", "numGames", "players", "playersById", "game", "numEvents", "numEventsSinceSnapshot", "pendingEvents")
+
+    def __init__(self, _id, seed=None):
         self.id = _id
-        if players is None:
-            self.players = []
-            self.game = None
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.numGames = 0
+        self.players = []
+        self.playersById = {}
+        self.game = None
+        self.numEvents = 0
+        self.numEventsSinceSnapshot = 0
+        self.pendingEvents = []
+
+    @staticmethod
+    def create(_id):
+        group = Group(_id)
+        group.record({"type": "create", "seed": group.seed})
+        return group
+
+    def record(self, event):
+        self.pendingEvents.append((self.numEvents, event))
+        self.numEvents += 1
+        self.numEventsSinceSnapshot += 1
+
+    def takePendingEvents(self):
+        events = self.pendingEvents
+        self.pendingEvents = []
+        return events
+
+    def apply(self, event, record=True):
+        """Apply a guess, guesses, numGuesses, join, set or newGame event. Returns the response to set events."""
+        eventType = event["type"]
+        response = None
+        if eventType == "guess":
+            self.game.handlePlayerGuess(self.playersById[event["userId"]], event["x"])
+        elif eventType == "guesses":
+            self.game.handlePlayerGuesses(self.playersById[event["userId"]], event["xs"])
+        elif eventType == "numGuesses":
+            self.game.handlePlayerWantsNumGuesses(self.playersById[event["userId"]], event["numGuesses"])
+        elif eventType == "join":
+            self.addPlayer(Player(SimpleNamespace(id=event["userId"], first_name=event["name"])))
+        elif eventType == "set":
+            response = self.game.settings.set(event["name"], event["value"])
+        elif eventType == "newGame":
+            self.game.resetFunction()
         else:
-            self.players = players
-            if settings is not None:
-                # Make sure we update the settings instead of using
-                # the one we read, in case the save file used a
-                # previous version of the settings class in which some
-                # parameters were not available
-                settings = GameSettings().update(settings)
-            self.game = Game(players, settings)
+            raise ValueError("Unknown event: {}".format(event))
+        if record:
+            self.record(event)
+        else:
+            self.numEvents += 1
+        return response
+
+    @staticmethod
+    def replay(_id, events, group=None):
+        """Apply the events to group, or to a new group if group is None, in which case the first event has to be its creation."""
+        if group is None:
+            assert events[0]["type"] == "create"
+            group = Group(_id, events[0]["seed"])
+            group.numEvents = 1
+            events = events[1:]
+        for event in events:
+            group.apply(event, record=False)
+            if group.game is not None:
+                group.game.log.clear()
+        group.numEventsSinceSnapshot = len(events)
+        return group
 
     def getPlayer(self, user):
-        player = findById(user, self.players, Player)
-        if player not in self.players:
-            self.addPlayer(player)
+        player = self.playersById.get(user.id)
+        if player is None:
+            self.apply({"type": "join", "userId": user.id, "name": user.first_name})
+            player = self.playersById[user.id]
         return player
 
     def addPlayer(self, player):
         logger.info("Registering new player {}".format(player))
         self.players.append(player)
+        self.playersById[player.id] = player
         previousSettings = None if self.game is None else self.game.settings
-        self.game = Game(self.players[:], previousSettings)
-
-    def save(self):
-        with getSaveFileName(self).open("w") as f:
-            if self.game is not None:
-                yaml.dump([self.id, self.players, self.game.settings], f)
+        self.game = Game(self.players[:], previousSettings, self.getNextGameSeed())
+
+    def getNextGameSeed(self):
+        self.numGames += 1
+        return random.Random("{}-{}".format(self.seed, self.numGames)).getrandbits(64)
+
+    def getState(self):
+        if self.game is None:
+            return None
+        return {
+            "id": self.id,
+            "seed": self.seed,
+            "numGames": self.numGames,
+            "numEvents": self.numEvents,
+            "players": [player.getState() for player in self.players],
+            "settings": self.game.settings.getState(),
+            "game": self.game.getState(),
+        }
+
+    @staticmethod
+    def fromState(state):
+        # Snapshots written by migrate.py have neither a seed nor a game, both have to be the same every time they are loaded
+        group = Group(state["id"], state.get("seed", random.Random("legacy-{}".format(state["id"])).getrandbits(64)))
+        group.numGames = state.get("numGames", 0)
+        group.numEvents = state.get("numEvents", 0)
+        group.players = [Player.fromState(playerState) for playerState in state["players"]]
+        group.playersById = {player.id: player for player in group.players}
+        # Make sure we update the settings instead of using
+        # the one we read, in case the save file used a
+        # previous version of the settings class in which some
+        # parameters were not available
+        settings = GameSettings().update(state["settings"])
+        if "game" in state:
+            group.game = Game(group.players[:], settings)
+            group.game.setState(state["game"])
+        else:
+            group.game = Game(group.players[:], settings, group.getNextGameSeed())
+        # Continue the running game without repeating the welcome message
+        group.game.log.clear()
+        return group
 
 
 class GuessBot:
-    def __init__(self):
-        self.groups = []
+    def __init__(self, storage=None, statistics=None):
+        with startupPhase("storage"):
+            self.storage = SqliteStorage(saveDatabase) if storage is None else storage
+            self.statistics = StatisticsStore(statisticsDatabase) if statistics is None else statistics
+        with startupPhase("index"):
+            self.savedGroupIds = set(self.storage.iterGroupIds())
+        self.saveQueue = SaveQueue(self.storage)
+        # Commands addressed to another bot (/command@otherBot) are ignored, unless this is None
+        self.username = None
+        self.groups = GroupRegistry(lambda chat: loadGroup(self.storage, self.savedGroupIds, chat, self.saveQueue), self.saveQueue.flushGroup)
+        self.commands = [
+            ("startNewGame", self.startNewGame),
+            ("score", self.showScore),
+            ("recap", self.recap),
+            ("roots", self.roots),
+            ("showSettings", self.showSettings),
+            ("help", self.help),
+            ("serve", self.serve),
+            ("hint", self.hint),
+            ("stats", self.stats),
+            ("leaderboard", self.leaderboard),
+            ("set", self.setParam),
+        ]
+        self.commandsByName = dict(self.commands)
 
     def recap(self, update, context):
         """Show all the guessed values in this current game"""
         group = self.getGroup(update.effective_chat)
         group.game.recap()
-        context.bot.send_message(chat_id=group.id, text=group.game.log.dump(), parse_mode="markdown")
+        self.sendLog(context, group, parseMode="markdown")
 
     def roots(self, update, context):
         """Show the number of guessed roots in this game for each player."""
         group = self.getGroup(update.effective_chat)
         group.game.playerRecap()
-        context.bot.send_message(chat_id=group.id, text=group.game.log.dump())
+        self.sendLog(context, group)
 
     def showScore(self, update, context):
         """Show the current score"""
         group = self.getGroup(update.effective_chat)
         group.game.showScore()
-        context.bot.send_message(chat_id=group.id, text=group.game.log.dump())
+        self.sendLog(context, group)
+
+    def hint(self, update, context):
+        """Show how many values can still be roots and where the next root is."""
+        group = self.getGroup(update.effective_chat)
+        group.game.hint()
+        self.sendLog(context, group)
+
+    def stats(self, update, context):
+        """Show your wins and roots over all groups, in this group and this week."""
+        group = self.getGroup(update.effective_chat)
+        user = update.effective_user
+        (allGames, groupGames, weekGames) = self.statistics.getPlayerStatistics(user.id, group.id)
+        lines = [formatTotals(user.first_name, allGames), formatTotals("In this group", groupGames), formatTotals("This week", weekGames)]
+        context.bot.send_message(chat_id=group.id, text="\n".join(lines))
+
+    def leaderboard(self, update, context):
+        """Show the players with the most wins: /leaderboard [all|week|group]"""
+        group = self.getGroup(update.effective_chat)
+        arguments = update.message.text.split(" ")[1:]
+        period = arguments[0] if len(arguments) > 0 else "all"
+        if period not in periods:
+            response = "Unknown period: {}. Use one of {}".format(period, ", ".join(periods))
+        else:
+            response = formatLeaderboard(self.statistics.getLeaderboard(period, group.id))
+        context.bot.send_message(chat_id=group.id, text=response)
+
+    def recordGames(self, group):
+        for event in group.game.log.iterEvents("gameOver"):
+            winners = event.data["winners"]
+            results = [
+                (player.id, player.name, player in winners, numGuessedRoots) for (player, numGuessedRoots) in zip(event.data["players"], event.data["numGuessedRoots"])
+            ]
+            self.statistics.queueGame(group.id, results, len(event.data["roots"]))
+            metrics.increment("finishedGames")
 
     def startNewGame(self, update, context):
         """Start a new game."""
         group = self.getGroup(update.effective_chat)
-        group.game.resetFunction()
-        context.bot.send_message(chat_id=group.id, text=group.game.log.dump())
+        group.apply({"type": "newGame"})
+        self.saveQueue.markDirty(group)
+        self.sendLog(context, group)
 
     def showSettings(self, update, context):
         """Display all settings"""
@@ -138,42 +325,66 @@ class GuessBot:
         paramNameValueString = content.replace("/set ", "")
         paramNameValue = paramNameValueString.split(" ")
         if len(paramNameValue) == 2:
-            response = group.game.settings.set(*paramNameValue)
+            response = group.apply({"type": "set", "name": paramNameValue[0], "value": paramNameValue[1]})
         else:
             response = group.game.settings.showHelp()
-        group.save()
+        self.saveQueue.markDirty(group)
         context.bot.send_message(chat_id=group.id, text=f"```\n{response}```", parse_mode="markdown")
 
     def parseMessage(self, update, context):
-        assert update.effective_chat.type == "group"
+        assert update.effective_chat.type in groupChatTypes
         group = self.getGroup(update.effective_chat)
         player = group.getPlayer(update.effective_user)
         content = update.message.text
         reply = self.processGuess(group, player, content)
-        if reply is not None and reply != "":
-            context.bot.send_message(chat_id=group.id, text=reply, parse_mode="markdown")
+        if reply is not None and len(reply) > 0:
+            for chunk in reply:
+                context.bot.send_message(chat_id=group.id, text=chunk, parse_mode="markdown")
             context.bot.delete_message(chat_id=group.id, message_id=update.message.message_id)
-        group.save()
+        self.saveQueue.markDirty(group)
 
     def processGuess(self, group, player, content):
-        if numGuessSettingIdentifierString in content:
-            numGuesses = tryConvertToInt(content.replace(numGuessSettingIdentifierString, ""))
-            if numGuesses is None:
-                return
-            group.game.handlePlayerWantsNumGuesses(player, numGuesses)
-        else:
-            guessedNumber = tryConvertToInt(content)
-            if guessedNumber is None:
+        with metrics.time("processGuess"):
+            if numGuessSettingIdentifierString in content:
+                numGuesses = tryConvertToInt(content.replace(numGuessSettingIdentifierString, ""))
+                if numGuesses is None:
+                    return
+                metrics.increment("numGuessSettings")
+                group.apply({"type": "numGuesses", "userId": player.id, "numGuesses": numGuesses})
+            else:
+                guessedNumbers = tryConvertToInts(content)
+                if guessedNumbers is None:
+                    return
+                metrics.increment("guesses", len(guessedNumbers))
+                if len(guessedNumbers) == 1:
+                    group.apply({"type": "guess", "userId": player.id, "x": guessedNumbers[0]})
+                else:
+                    group.apply({"type": "guesses", "userId": player.id, "xs": guessedNumbers})
+            metrics.increment("autoplays", sum(1 for _ in group.game.log.iterEvents("obviousRoot")))
+            self.recordGames(group)
+            return group.game.log.dumpChunks()
+
+    def handleUpdate(self, update, context):
+        content = update.message.text
+        if content.startswith("/"):
+            # Commands may be addressed to a specific bot: /command@botName
+            (name, _, botName) = content[1:].split(" ")[0].partition("@")
+            if botName != "" and self.username is not None and botName.lower() != self.username.lower():
                 return
-            group.game.handlePlayerGuess(player, guessedNumber)
-        return group.game.log.dump()
+            command = self.commandsByName.get(name)
+            if command is not None:
+                with metrics.time("handler.{}".format(name)):
+                    command(update, context)
+        elif update.effective_chat.type in groupChatTypes:
+            with metrics.time("handler.parseMessage"):
+                self.parseMessage(update, context)
+
+    def sendLog(self, context, group, parseMode=None):
+        for chunk in group.game.log.dumpChunks():
+            context.bot.send_message(chat_id=group.id, text=chunk, parse_mode=parseMode)
 
     def getGroup(self, chat):
-        group = findById(chat, self.groups, getNewGroup)
-        if group not in self.groups:
-            logger.info("Registering new group {}".format(group))
-            self.groups.append(group)
-        return group
+        return self.groups.get(chat)
 
     def error(self, update, context):
         logger.warning('Update "%s" caused error "%s"', update, context.error)
@@ -184,32 +395,61 @@ class GuessBot:
         content = "\n".join("/{}: {}".format(name, command.__doc__) for (name, command) in self.commands)
         context.bot.send_message(chat_id=group.id, text=content)
 
-    def main(self):
-        with open("apiToken", "r") as f:
-            token = f.readlines()[0].replace("\n", "")
-        updater = Updater(token)
+    def setupMetrics(self, args, runtime):
+        metrics.setGauge("loadedGroups", lambda: len(self.groups))
+        metrics.setGauge("saveQueue", self.saveQueue.getStats)
+        metrics.setGauge("outbox", runtime.outbox.getStats)
+        if args.profile:
+            metrics.profiler = SamplingProfiler()
+            metrics.profiler.start()
+        if args.metricsFile is not None:
+            metrics.startDumping(args.metricsFile, args.metricsInterval)
+        if args.metricsPort is not None:
+            metrics.startServer(args.metricsPort)
+
+    def reportStartup(self, budget):
+        total = sum(startupTimes.values())
+        breakdown = ", ".join("{} {:.3f}s".format(name, duration) for (name, duration) in startupTimes.items())
+        logger.info("Startup took {:.3f}s ({}) with {:,} saved groups".format(total, breakdown, len(self.savedGroupIds)))
+        if total > budget:
+            logger.warning("Startup took longer than the budget of {:.3f}s".format(budget))
+        startup = dict(startupTimes, total=total)
+        metrics.setGauge("startup", lambda: startup)
+
+    def main(self, args):
+        with startupPhase("transport"):
+            transport = TelegramTransport(readToken(), baseUrl=args.apiUrl)
+            self.username = transport.getUsername()
+            runtime = Runtime(self, transport, outbox=Outbox(transport, globalRate=args.globalRate))
+        self.setupMetrics(args, runtime)
+        self.reportStartup(args.startupBudget)
+        # Not needed until the first new game, so it is imported while the bot already waits for updates
+        threading.Thread(target=getNumpy, name="ImportNumpy", daemon=True).start()
+        runUntilInterrupted(runtime.run())
+        self.storage.close()
+        self.statistics.close()
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--metricsFile", default="metrics.json", help="File to which the metrics are written periodically")
+    parser.add_argument("--metricsInterval", type=float, default=60.0, help="Seconds between two writes of the metrics file")
+    parser.add_argument("--metricsPort", type=int, default=None, help="Serve the metrics on http://localhost:PORT/")
+    parser.add_argument("--profile", action="store_true", help="Run a sampling profiler and include its results in the metrics")
+    parser.add_argument("--apiUrl", default=None, help="Use this instead of https://api.telegram.org/bot, e.g. for a local fake server")
+    parser.add_argument("--globalRate", type=float, default=defaultGlobalRate, help="Messages per second the bot sends in total")
+    parser.add_argument("--numShards", type=int, default=1, help="Handle the chats in this many processes, each with its own save database")
+    parser.add_argument("--startupBudget", type=float, default=2.0, help="Warn if starting the bot takes longer than this many seconds")
+    return parser.parse_args()
 
-        dispatcher = updater.dispatcher
-        dispatcher.add_error_handler(self.error)
-        self.commands = [
-            ("startNewGame", self.startNewGame),
-            ("score", self.showScore),
-            ("recap", self.recap),
-            ("roots", self.roots),
-            ("showSettings", self.showSettings),
-            ("help", self.help),
-            ("serve", self.serve),
-            ("set", self.setParam),
-        ]
-
-        for (name, command) in self.commands:
-            dispatcher.add_handler(CommandHandler(name, command))
-        dispatcher.add_handler(MessageHandler(Filters.chat_type.groups, self.parseMessage))
 
-        updater.start_polling()
-        updater.idle()
-
-
-bot = GuessBot()
 if __name__ == "__main__":
-    bot.main()
+    args = parseArguments()
+    if args.numShards == 1:
+        rebalance(saveDatabase, 1)
+        bot = GuessBot()
+        bot.main(args)
+    else:
+        token = readToken()
+        makeTransport = functools.partial(TelegramTransport, token, baseUrl=args.apiUrl)
+        runSharded(makeTransport(), args.numShards, saveDatabase, makeTransport, args.globalRate, args)
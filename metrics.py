@@ -0,0 +1,157 @@
+from contextlib import contextmanager
+import asyncio
+import bisect
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+gaugeTimeout = 10.0
+
+# Histogram buckets from 1us to about 2 minutes, doubling each time
+bucketBounds = [1e-6 * 2**i for i in range(28)]
+
+
+class Histogram:
+    def __init__(self):
+        self.bucketCounts = [0 for _ in range(len(bucketBounds) + 1)]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.bucketCounts[bisect.bisect_left(bucketBounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def getPercentile(self, percentile):
+        """The upper bound of the bucket containing the given percentile."""
+        rank = self.count * percentile / 100
+        numSeen = 0
+        for (bound, bucketCount) in zip(bucketBounds, self.bucketCounts):
+            numSeen += bucketCount
+            if numSeen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def getSnapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count > 0 else 0.0,
+            "p50": self.getPercentile(50),
+            "p90": self.getPercentile(90),
+            "p99": self.getPercentile(99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """Counters, latency histograms (in seconds) and gauges, which are read from a function whenever a snapshot is taken.
+    Gauges look at state that the event loop changes, so while a loop is set they are read on it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.profiler = None
+        self.loop = None
+        self.startTime = time.time()
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[name] = histogram
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def setGauge(self, name, function):
+        self.gauges[name] = function
+
+    def setLoop(self, loop):
+        self.loop = loop
+
+    def readGauges(self):
+        return {name: function() for (name, function) in self.gauges.items()}
+
+    async def readGaugesAsync(self):
+        return self.readGauges()
+
+    def getGauges(self):
+        loop = self.loop
+        try:
+            onLoop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            onLoop = False
+        if loop is None or onLoop:
+            return self.readGauges()
+        return asyncio.run_coroutine_threadsafe(self.readGaugesAsync(), loop).result(gaugeTimeout)
+
+    def getSnapshot(self):
+        with self.lock:
+            snapshot = {
+                "uptime": time.time() - self.startTime,
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.getSnapshot() for (name, histogram) in self.histograms.items()},
+            }
+        snapshot["gauges"] = self.getGauges()
+        if self.profiler is not None:
+            snapshot["profile"] = self.profiler.getTopStacks()
+        return snapshot
+
+    def dump(self, path):
+        content = json.dumps(self.getSnapshot(), indent=2)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def startDumping(self, path, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except Exception:
+                    logger.exception("Writing the metrics to %s failed", path)
+
+        threading.Thread(target=run, name="MetricsDump", daemon=True).start()
+
+    def startServer(self, port):
+        """Serve the snapshot as JSON on http://localhost:port/"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                content = json.dumps(metrics.getSnapshot(), indent=2).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("localhost", port), Handler)
+        threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+        return server
+
+
+registry = Metrics()
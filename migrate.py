@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Import the per-chat YAML save files written by older versions of the bot into a storage backend."""
+
+from pathlib import Path
+import argparse
+import yaml
+from storage import openStorage
+
+
+class LegacyLoader(yaml.SafeLoader):
+    pass
+
+
+def constructObject(loader, suffix, node):
+    # Players and settings were dumped as python objects. Read them as plain dicts
+    # so that no code from the save file gets executed.
+    state = loader.construct_mapping(node, deep=True)
+    return state.get("state", state)
+
+
+LegacyLoader.add_multi_constructor("tag:yaml.org,2002:python/object:", constructObject)
+LegacyLoader.add_multi_constructor("tag:yaml.org,2002:python/object/apply:", constructObject)
+
+
+def readLegacySaveFile(path):
+    with path.open("r") as f:
+        content = yaml.load(f, Loader=LegacyLoader)
+    if content is None:
+        return None
+    (groupId, players, settings) = content
+    return {
+        "id": groupId,
+        "players": [{"id": player["id"], "name": player["name"], "score": player.get("score", 0)} for player in players],
+        "settings": {k: settings[k] for k in settings["names"]},
+    }
+
+
+def migrate(saveFolder, storage):
+    states = []
+    for path in sorted(Path(saveFolder).iterdir()):
+        state = readLegacySaveFile(path)
+        if state is not None:
+            states.append((state["id"], state))
+    storage.saveMany(states)
+    return len(states)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("saveFolder", nargs="?", default="save")
+    parser.add_argument("--backend", choices=["sqlite", "yaml"], default="sqlite")
+    parser.add_argument("--target", default="save.sqlite")
+    args = parser.parse_args()
+    storage = openStorage(args.backend, args.target)
+    numGroups = migrate(args.saveFolder, storage)
+    storage.close()
+    print("Migrated {} groups from {} to {}".format(numGroups, args.saveFolder, args.target))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+from collections import deque
+import asyncio
+import logging
+import time
+from transport import RateLimited
+from metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+maxMessageLength = 4096
+# Telegram allows bots to send about 30 messages per second in total
+defaultGlobalRate = 30.0
+
+
+class RateLimiter:
+    """Allows one call per interval. Callers wait for their turn in the order in which they arrived."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.nextAllowedTime = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        waitTime = self.nextAllowedTime - now
+        self.nextAllowedTime = max(now, self.nextAllowedTime) + self.interval
+        if waitTime > 0:
+            await asyncio.sleep(waitTime)
+
+    def delay(self, delay):
+        self.nextAllowedTime = max(self.nextAllowedTime, time.monotonic() + delay)
+
+
+class Outbox:
+    """Sends messages to Telegram through one queue per chat. Consecutive messages to a chat that are
+    queued within coalesceWindow of each other are merged into a single message and all pending
+    deletions of a chat are sent together. Sending respects a minimum interval per chat and a global
+    rate limit and backs off when Telegram reports that we are sending too much."""
+
+    def __init__(self, transport, coalesceWindow=0.2, chatInterval=1.0, globalRate=defaultGlobalRate, maxNumRetries=5):
+        self.transport = transport
+        self.coalesceWindow = coalesceWindow
+        self.chatInterval = chatInterval
+        self.globalRateLimiter = RateLimiter(1.0 / globalRate)
+        self.maxNumRetries = maxNumRetries
+        self.chatRateLimiters = {}
+        self.pendingMessages = {}
+        self.pendingDeletions = {}
+        self.chatTasks = {}
+        self.numSentMessages = 0
+        self.numMergedMessages = 0
+        self.numDeletedMessages = 0
+        self.numFailedMessages = 0
+        self.numFailedDeletions = 0
+        self.numRetries = 0
+        self.sendLatencies = deque(maxlen=1000)
+
+    def sendMessage(self, chatId, text, parseMode=None):
+        self.pendingMessages.setdefault(chatId, deque()).append((time.perf_counter(), text, parseMode))
+        self.startChatTask(chatId)
+
+    def deleteMessage(self, chatId, messageId):
+        self.pendingDeletions.setdefault(chatId, []).append(messageId)
+        self.startChatTask(chatId)
+
+    def startChatTask(self, chatId):
+        if chatId not in self.chatTasks:
+            self.chatTasks[chatId] = asyncio.create_task(self.processChat(chatId))
+
+    async def processChat(self, chatId):
+        try:
+            while chatId in self.pendingMessages or chatId in self.pendingDeletions:
+                await asyncio.sleep(self.coalesceWindow)
+                for message in mergeMessages(self.pendingMessages.pop(chatId, [])):
+                    await self.send(chatId, *message)
+                messageIds = self.pendingDeletions.pop(chatId, [])
+                if len(messageIds) > 0:
+                    with metrics.time("telegram.deleteMessages"):
+                        deleted = await self.retry(self.transport.deleteMessages, chatId, messageIds)
+                    if deleted:
+                        self.numDeletedMessages += len(messageIds)
+                    else:
+                        self.numFailedDeletions += len(messageIds)
+                        metrics.increment("outbox.failedDeletions", len(messageIds))
+        finally:
+            del self.chatTasks[chatId]
+
+    async def send(self, chatId, queueTime, text, parseMode, numMerged):
+        chatRateLimiter = self.chatRateLimiters.setdefault(chatId, RateLimiter(self.chatInterval))
+        await self.globalRateLimiter.wait()
+        await chatRateLimiter.wait()
+        with metrics.time("telegram.sendMessage"):
+            sent = await self.retry(self.transport.sendMessage, chatId, text, parseMode, rateLimiter=chatRateLimiter)
+        if not sent:
+            self.numFailedMessages += 1
+            metrics.increment("outbox.failedMessages")
+            return
+        self.numSentMessages += 1
+        self.numMergedMessages += numMerged - 1
+        self.sendLatencies.append(time.perf_counter() - queueTime)
+        metrics.observe("outbox.sendLatency", self.sendLatencies[-1])
+
+    async def retry(self, function, *args, rateLimiter=None):
+        """Returns whether the call succeeded."""
+        for numRetries in range(self.maxNumRetries + 1):
+            try:
+                await function(*args)
+                return True
+            except RateLimited as e:
+                if numRetries == self.maxNumRetries:
+                    logger.warning("Giving up on %s%s after %d retries", function.__name__, args, numRetries)
+                    return False
+                self.numRetries += 1
+                metrics.increment("telegram.rateLimited")
+                self.globalRateLimiter.delay(e.retryAfter)
+                if rateLimiter is not None:
+                    rateLimiter.delay(e.retryAfter)
+                await asyncio.sleep(e.retryAfter)
+            except Exception as e:
+                logger.warning('Calling %s%s failed with "%s"', function.__name__, args, e)
+                return False
+
+    async def join(self):
+        while len(self.chatTasks) > 0:
+            await asyncio.gather(*self.chatTasks.values())
+
+    def getQueueLength(self):
+        return sum(len(messages) for messages in self.pendingMessages.values()) + sum(
+            len(messageIds) for messageIds in self.pendingDeletions.values()
+        )
+
+    def getStats(self):
+        latencies = sorted(self.sendLatencies)
+        return {
+            "queueLength": self.getQueueLength(),
+            "numSentMessages": self.numSentMessages,
+            "numMergedMessages": self.numMergedMessages,
+            "numDeletedMessages": self.numDeletedMessages,
+            "numFailedMessages": self.numFailedMessages,
+            "numFailedDeletions": self.numFailedDeletions,
+            "numRetries": self.numRetries,
+            "sendLatencyP50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "sendLatencyMax": latencies[-1] if latencies else 0.0,
+        }
+
+
+def mergeMessages(messages):
+    """Joins consecutive messages with the same parse mode as long as they fit into a single Telegram message.
+    Yields (queueTime, text, parseMode, numMerged) with the queue time of the oldest message."""
+    current = None
+    for (queueTime, text, parseMode) in messages:
+        if current is not None and current[2] == parseMode and len(current[1]) + 1 + len(text) <= maxMessageLength:
+            current = (current[0], current[1] + "\n" + text, parseMode, current[3] + 1)
+        else:
+            if current is not None:
+                yield current
+            current = (queueTime, text, parseMode, 1)
+    if current is not None:
+        yield current
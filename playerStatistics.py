@@ -0,0 +1,146 @@
+"""Statistics over the games of all groups. Every finished game is recorded once and added to running
+totals per player, per player and group and per player and week, so that queries never have to look at
+the individual games."""
+
+from types import SimpleNamespace
+import datetime
+import sqlite3
+import threading
+import time
+
+numLeaderboardEntries = 10
+periods = ["all", "week", "group"]
+
+
+def getWeek(timestamp):
+    (year, week, _) = datetime.date.fromtimestamp(timestamp).isocalendar()
+    return "{}-W{:02}".format(year, week)
+
+
+class StatisticsStore:
+    """The games and totals in a SQLite database. Several processes can record games into the same database.
+    Like the SaveQueue, the bot only queues finished games with queueGame and writes them in batches:
+    takeQueuedGames has to be called from the thread that queues them, recordGames may be called from any thread."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS games (id INTEGER PRIMARY KEY, groupId INTEGER NOT NULL, time REAL NOT NULL, numRoots INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS results (gameId INTEGER NOT NULL, playerId INTEGER NOT NULL, won INTEGER NOT NULL, numRoots INTEGER NOT NULL, PRIMARY KEY (gameId, playerId));
+            CREATE TABLE IF NOT EXISTS playerTotals (
+                playerId INTEGER PRIMARY KEY, name TEXT NOT NULL, numGames INTEGER NOT NULL, numWins INTEGER NOT NULL, numRoots INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS groupTotals (
+                groupId INTEGER NOT NULL, playerId INTEGER NOT NULL, numGames INTEGER NOT NULL, numWins INTEGER NOT NULL, numRoots INTEGER NOT NULL,
+                PRIMARY KEY (groupId, playerId)
+            );
+            CREATE TABLE IF NOT EXISTS weekTotals (
+                week TEXT NOT NULL, playerId INTEGER NOT NULL, numGames INTEGER NOT NULL, numWins INTEGER NOT NULL, numRoots INTEGER NOT NULL,
+                PRIMARY KEY (week, playerId)
+            );
+            CREATE INDEX IF NOT EXISTS playerTotalsByWins ON playerTotals (numWins DESC, numGames);
+            CREATE INDEX IF NOT EXISTS groupTotalsByWins ON groupTotals (groupId, numWins DESC, numGames);
+            CREATE INDEX IF NOT EXISTS weekTotalsByWins ON weekTotals (week, numWins DESC, numGames);
+            """
+        )
+        self.connection.commit()
+        self.queuedGames = []
+
+    def queueGame(self, groupId, results, numRoots, timestamp=None):
+        self.queuedGames.append((groupId, results, numRoots, time.time() if timestamp is None else timestamp))
+
+    def takeQueuedGames(self):
+        games = self.queuedGames
+        self.queuedGames = []
+        return games
+
+    def flush(self):
+        self.recordGames(self.takeQueuedGames())
+
+    def recordGames(self, games):
+        """Record the games, as (groupId, results, numRoots, timestamp), in one transaction."""
+        if len(games) == 0:
+            return
+        with self.lock, self.connection:
+            for game in games:
+                self.insertGame(*game)
+
+    def recordGame(self, groupId, results, numRoots, timestamp=None):
+        """results are (player id, player name, won, number of guessed roots) for every player of the game."""
+        with self.lock, self.connection:
+            return self.insertGame(groupId, results, numRoots, time.time() if timestamp is None else timestamp)
+
+    def insertGame(self, groupId, results, numRoots, timestamp):
+        """Has to be called with the lock held, inside a transaction."""
+        week = getWeek(timestamp)
+        gameId = self.connection.execute("INSERT INTO games (groupId, time, numRoots) VALUES (?, ?, ?)", (groupId, timestamp, numRoots)).lastrowid
+        self.connection.executemany(
+            "INSERT INTO results (gameId, playerId, won, numRoots) VALUES (?, ?, ?, ?)",
+            [(gameId, playerId, int(won), numGuessedRoots) for (playerId, _, won, numGuessedRoots) in results],
+        )
+        self.connection.executemany(
+            """INSERT INTO playerTotals (playerId, name, numGames, numWins, numRoots) VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT (playerId) DO UPDATE SET
+            name = excluded.name, numGames = numGames + 1, numWins = numWins + excluded.numWins, numRoots = numRoots + excluded.numRoots""",
+            [(playerId, name, int(won), numGuessedRoots) for (playerId, name, won, numGuessedRoots) in results],
+        )
+        for (table, key, keyValue) in (("groupTotals", "groupId", groupId), ("weekTotals", "week", week)):
+            self.connection.executemany(
+                """INSERT INTO {table} ({key}, playerId, numGames, numWins, numRoots) VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT ({key}, playerId) DO UPDATE SET
+                numGames = numGames + 1, numWins = numWins + excluded.numWins, numRoots = numRoots + excluded.numRoots""".format(table=table, key=key),
+                [(keyValue, playerId, int(won), numGuessedRoots) for (playerId, _, won, numGuessedRoots) in results],
+            )
+        return gameId
+
+    def getPlayerStatistics(self, playerId, groupId, timestamp=None):
+        """The totals of the player over all games, the games in the group and the games of this week. Each is None if there are no games."""
+        week = getWeek(time.time() if timestamp is None else timestamp)
+        with self.lock:
+            rows = [
+                self.connection.execute("SELECT numGames, numWins, numRoots FROM playerTotals WHERE playerId = ?", (playerId,)).fetchone(),
+                self.connection.execute("SELECT numGames, numWins, numRoots FROM groupTotals WHERE groupId = ? AND playerId = ?", (groupId, playerId)).fetchone(),
+                self.connection.execute("SELECT numGames, numWins, numRoots FROM weekTotals WHERE week = ? AND playerId = ?", (week, playerId)).fetchone(),
+            ]
+        return [None if row is None else SimpleNamespace(numGames=row[0], numWins=row[1], numRoots=row[2]) for row in rows]
+
+    def getLeaderboard(self, period="all", groupId=None, timestamp=None, numEntries=numLeaderboardEntries):
+        """The players with the most wins, as (name, numGames, numWins, numRoots), over all games, the games of a group or the games of this week."""
+        if period == "all":
+            (query, parameters) = ("SELECT name, numGames, numWins, numRoots FROM playerTotals", ())
+        elif period == "group":
+            (query, parameters) = ("SELECT name, t.numGames, t.numWins, t.numRoots FROM groupTotals t JOIN playerTotals USING (playerId) WHERE groupId = ?", (groupId,))
+        elif period == "week":
+            week = getWeek(time.time() if timestamp is None else timestamp)
+            (query, parameters) = ("SELECT name, t.numGames, t.numWins, t.numRoots FROM weekTotals t JOIN playerTotals USING (playerId) WHERE week = ?", (week,))
+        else:
+            raise ValueError("Unknown period: {}".format(period))
+        prefix = "t." if period != "all" else ""
+        query += " ORDER BY {0}numWins DESC, {0}numGames LIMIT ?".format(prefix)
+        with self.lock:
+            return self.connection.execute(query, parameters + (numEntries,)).fetchall()
+
+    def getNumGames(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def formatTotals(label, totals):
+    if totals is None:
+        return "{}: no games yet".format(label)
+    return "{}: {} wins in {} games ({:.0%}), {} roots".format(label, totals.numWins, totals.numGames, totals.numWins / totals.numGames, totals.numRoots)
+
+
+def formatLeaderboard(rows):
+    if len(rows) == 0:
+        return "No games yet"
+    return "\n".join(
+        "{}. {}: {} wins in {} games, {} roots".format(rank, name, numWins, numGames, numRoots) for (rank, (name, numGames, numWins, numRoots)) in enumerate(rows, 1)
+    )
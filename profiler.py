@@ -0,0 +1,43 @@
+from collections import Counter
+import sys
+import threading
+import time
+
+
+class SamplingProfiler:
+    """Samples the stacks of all other threads every interval seconds and counts how often each stack was seen."""
+
+    def __init__(self, interval=0.005, maxDepth=12):
+        self.interval = interval
+        self.maxDepth = maxDepth
+        self.stackCounts = Counter()
+        self.numSamples = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="SamplingProfiler", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        ownThreadId = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            for (threadId, frame) in sys._current_frames().items():
+                if threadId != ownThreadId:
+                    self.stackCounts[getStack(frame, self.maxDepth)] += 1
+            self.numSamples += 1
+
+    def getTopStacks(self, numStacks=20):
+        return {
+            "numSamples": self.numSamples,
+            "stacks": [{"count": count, "stack": list(stack)} for (stack, count) in self.stackCounts.most_common(numStacks)],
+        }
+
+
+def getStack(frame, maxDepth):
+    stack = []
+    while frame is not None and len(stack) < maxDepth:
+        code = frame.f_code
+        stack.append("{}:{}:{}".format(code.co_filename.split("/")[-1], code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    return tuple(stack)
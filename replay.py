@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""Reconstruct a group by replaying its event log and report how fast the events were applied."""
+
+import argparse
+import logging
+import time
+from storage import openStorage
+
+
+def main():
+    from main import Group
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("groupId", type=int)
+    parser.add_argument("--backend", choices=["sqlite", "yaml"], default="sqlite")
+    parser.add_argument("--storage", default="save.sqlite")
+    parser.add_argument("--fromSnapshot", action="store_true", help="Start from the last snapshot instead of the creation of the group")
+    parser.add_argument("--numEvents", type=int, default=None, help="Only replay this many events")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    storage = openStorage(args.backend, args.storage)
+    state = storage.load(args.groupId) if args.fromSnapshot else None
+    group = None if state is None else Group.fromState(state)
+    events = storage.loadEvents(args.groupId, 0 if group is None else group.numEvents)
+    storage.close()
+    if args.numEvents is not None:
+        events = events[: args.numEvents]
+    start = time.perf_counter()
+    group = Group.replay(args.groupId, events, group)
+    duration = time.perf_counter() - start
+    print("Replayed {:,} events in {:.3f}s ({:,.0f} events/s)".format(len(events), duration, len(events) / max(duration, 1e-9)))
+    if group.game is not None:
+        group.game.showScore()
+        group.game.recap()
+        print(group.game.log.dump())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+from collections import deque
+from types import SimpleNamespace
+import asyncio
+import logging
+import signal
+from metrics import registry as metrics
+from outbox import Outbox
+from transport import RateLimited, Stopped
+
+logger = logging.getLogger(__name__)
+
+defaultFlushInterval = 5.0
+minPollBackoff = 1.0
+maxPollBackoff = 60.0
+
+
+async def pollUpdates(transport):
+    """Gets the next updates from transport. Like the Updater of python-telegram-bot, polling never gives up:
+    rate limits are waited out and other errors are retried with exponential backoff."""
+    backoff = minPollBackoff
+    while True:
+        try:
+            return await transport.getUpdates()
+        except Stopped:
+            raise
+        except RateLimited as e:
+            logger.warning("Polling was rate limited, retrying after %ss", e.retryAfter)
+            await asyncio.sleep(e.retryAfter)
+        except Exception as e:
+            logger.warning('Polling failed with "%s", retrying after %ss', e, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(2 * backoff, maxPollBackoff)
+
+
+def runUntilInterrupted(coroutine):
+    """Runs coroutine like asyncio.run until it returns or the process gets SIGINT, SIGTERM or SIGABRT.
+    All of them cancel the coroutine, so that it can still shut down cleanly, e.g. save and send what is pending."""
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        for signalNumber in (signal.SIGTERM, signal.SIGABRT):
+            loop.add_signal_handler(signalNumber, task.cancel)
+        await coroutine
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+class OutboxBot:
+    """Takes the place of context.bot in the handlers and queues everything they send in the outbox."""
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        self.outbox.sendMessage(chat_id, text, parse_mode)
+
+    def delete_message(self, chat_id, message_id):
+        self.outbox.deleteMessage(chat_id, message_id)
+
+
+class Runtime:
+    """Runs a GuessBot on an asyncio event loop. Updates of a group are handled in order by one task
+    per group. Replies are sent through the outbox, so that handling updates never waits for the
+    network. Saving happens periodically in the default executor."""
+
+    def __init__(self, bot, transport, flushInterval=defaultFlushInterval, outbox=None):
+        self.bot = bot
+        self.transport = transport
+        self.flushInterval = flushInterval
+        self.outbox = Outbox(transport) if outbox is None else outbox
+        self.outboxBot = OutboxBot(self.outbox)
+        self.groupQueues = {}
+        self.groupTasks = set()
+
+    async def run(self):
+        flushTask = asyncio.create_task(self.flushPeriodically())
+        metrics.setLoop(asyncio.get_running_loop())
+        try:
+            while True:
+                for update in await pollUpdates(self.transport):
+                    self.dispatch(update)
+        finally:
+            flushTask.cancel()
+            await self.join()
+            await self.flush(forceSnapshot=True)
+            metrics.setLoop(None)
+
+    def dispatch(self, update):
+        chatId = update.effective_chat.id
+        queue = self.groupQueues.get(chatId)
+        if queue is None:
+            queue = deque()
+            self.groupQueues[chatId] = queue
+            task = asyncio.create_task(self.processGroup(chatId, queue))
+            self.groupTasks.add(task)
+            task.add_done_callback(self.groupTasks.discard)
+        queue.append(update)
+
+    async def processGroup(self, chatId, queue):
+        while len(queue) > 0:
+            self.handle(queue.popleft())
+            # Give other groups a chance to run
+            await asyncio.sleep(0)
+        del self.groupQueues[chatId]
+
+    def handle(self, update):
+        context = SimpleNamespace(bot=self.outboxBot, error=None)
+        try:
+            self.bot.handleUpdate(update, context)
+        except Exception as e:
+            context.error = e
+            self.bot.error(update, context)
+
+    async def join(self):
+        while len(self.groupTasks) > 0:
+            await asyncio.gather(*self.groupTasks)
+        await self.outbox.join()
+
+    async def flushPeriodically(self):
+        while True:
+            await asyncio.sleep(self.flushInterval)
+            await self.flush()
+
+    async def flush(self, forceSnapshot=False):
+        changed = self.bot.saveQueue.takeChanged(forceSnapshot)
+        games = self.bot.statistics.takeQueuedGames()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.bot.saveQueue.write, changed)
+        await loop.run_in_executor(None, self.bot.statistics.recordGames, games)
@@ -0,0 +1,115 @@
+from collections import Counter
+import threading
+import time
+from metrics import registry as metrics
+
+defaultSnapshotInterval = 50
+
+
+class SaveQueue:
+    """Write-behind saving: groups are marked dirty after every message and written in batches by flush.
+    The events of a group are appended to its event log on every flush, while a snapshot of its state is
+    only written every snapshotInterval events (and for forced flushes). Loading a group replays the events
+    that happened after its last snapshot.
+    takeChanged has to be called from the thread that modifies the groups, write may be called from any thread.
+    Until the changes are written, waitUntilWritten blocks loading the groups they belong to."""
+
+    def __init__(self, storage, snapshotInterval=defaultSnapshotInterval):
+        self.storage = storage
+        self.snapshotInterval = snapshotInterval
+        self.lock = threading.Lock()
+        self.writtenCondition = threading.Condition()
+        self.unwrittenGroupIds = Counter()
+        self.dirtyGroups = {}
+        self.groupsWithoutSnapshot = {}
+        self.numSnapshots = 0
+        self.numEvents = 0
+        self.numSkippedWrites = 0
+        self.lastFlushLatency = 0.0
+        self.maxFlushLatency = 0.0
+
+    def markDirty(self, group):
+        self.dirtyGroups[group.id] = group
+
+    def flushGroup(self, group):
+        self.dirtyGroups.pop(group.id, None)
+        self.write(self.getChanges([group], forceSnapshot=True))
+
+    def flush(self, forceSnapshot=False):
+        self.write(self.takeChanged(forceSnapshot))
+
+    def takeChanged(self, forceSnapshot=False):
+        groups = self.dirtyGroups
+        self.dirtyGroups = {}
+        if forceSnapshot:
+            groups.update(self.groupsWithoutSnapshot)
+        return self.getChanges(list(groups.values()), forceSnapshot)
+
+    def getChanges(self, groups, forceSnapshot=False):
+        events = []
+        states = []
+        for group in groups:
+            groupEvents = group.takePendingEvents()
+            if len(groupEvents) == 0 and not (forceSnapshot and group.id in self.groupsWithoutSnapshot):
+                self.numSkippedWrites += 1
+                metrics.increment("skippedSaves")
+                continue
+            events.extend((group.id, index, event) for (index, event) in groupEvents)
+            state = group.getState()
+            if state is not None and (forceSnapshot or group.numEventsSinceSnapshot >= self.snapshotInterval):
+                states.append((group.id, state))
+                group.numEventsSinceSnapshot = 0
+                self.groupsWithoutSnapshot.pop(group.id, None)
+            elif state is not None:
+                self.groupsWithoutSnapshot[group.id] = group
+            else:
+                # Groups without players have no state, their events alone are enough to load them again
+                self.groupsWithoutSnapshot.pop(group.id, None)
+        self.addUnwritten((events, states), 1)
+        return (events, states)
+
+    def addUnwritten(self, changes, amount):
+        (events, states) = changes
+        groupIds = {groupId for (groupId, _, _) in events} | {groupId for (groupId, _) in states}
+        with self.writtenCondition:
+            for groupId in groupIds:
+                self.unwrittenGroupIds[groupId] += amount
+                if self.unwrittenGroupIds[groupId] == 0:
+                    del self.unwrittenGroupIds[groupId]
+            self.writtenCondition.notify_all()
+
+    def waitUntilWritten(self, groupId):
+        """Wait for the changes of the group that were taken but are still being written, so that loading it sees them."""
+        with self.writtenCondition:
+            while groupId in self.unwrittenGroupIds:
+                self.writtenCondition.wait()
+
+    def write(self, changes):
+        (events, states) = changes
+        if len(events) == 0 and len(states) == 0:
+            return
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                # Events first: a crash in between leaves an older snapshot whose later events are complete
+                self.storage.appendEvents(events)
+                self.storage.saveMany(states)
+                self.numEvents += len(events)
+                self.numSnapshots += len(states)
+                self.lastFlushLatency = time.perf_counter() - start
+                self.maxFlushLatency = max(self.maxFlushLatency, self.lastFlushLatency)
+        finally:
+            self.addUnwritten(changes, -1)
+        metrics.increment("savedEvents", len(events))
+        metrics.increment("savedSnapshots", len(states))
+        metrics.observe("saveBatch", self.lastFlushLatency)
+
+    def getStats(self):
+        return {
+            "queueDepth": len(self.dirtyGroups),
+            "numEvents": self.numEvents,
+            "numSnapshots": self.numSnapshots,
+            "numSkippedWrites": self.numSkippedWrites,
+            "lastFlushLatency": self.lastFlushLatency,
+            "maxFlushLatency": self.maxFlushLatency,
+        }
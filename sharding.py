@@ -0,0 +1,205 @@
+"""Runs the bot in several processes. The dispatcher polls Telegram and routes every update by chat id
+to one of numShards worker processes. Each worker owns the groups of its chats, has its own save
+database and sends its replies itself."""
+
+from pathlib import Path
+import asyncio
+import logging
+import multiprocessing
+import queue
+from outbox import Outbox, defaultGlobalRate
+from runtime import Runtime, pollUpdates, runUntilInterrupted
+from storage import SqliteStorage
+from transport import Stopped
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker blocks on its update queue at a time, which bounds how long it takes to exit once cancelled
+queueTimeout = 1.0
+
+
+def getShard(chatId, numShards):
+    return chatId % numShards
+
+
+def getShardDatabase(database, shard, numShards):
+    """Without sharding the bot uses database itself, so switching between the two only needs a rebalance."""
+    if numShards == 1:
+        return Path(database)
+    return Path(database).with_suffix(".{}-of-{}.sqlite".format(shard, numShards))
+
+
+def getLayoutPath(database):
+    return Path(database).with_suffix(".shards")
+
+
+def readNumShards(database):
+    path = getLayoutPath(database)
+    if not path.is_file():
+        return 1
+    return int(path.read_text())
+
+
+def rebalance(database, numShards):
+    """Moves every group to the database of its shard if the number of shards changed since the last run.
+    The previous databases are only removed once all groups have been copied, so an interrupted
+    rebalance is simply repeated on the next start."""
+    previousNumShards = readNumShards(database)
+    if previousNumShards == numShards:
+        return
+    logger.info("Rebalancing the groups from {} to {} shards".format(previousNumShards, numShards))
+    sourcePaths = [getShardDatabase(database, shard, previousNumShards) for shard in range(previousNumShards)]
+    targets = [SqliteStorage(getShardDatabase(database, shard, numShards)) for shard in range(numShards)]
+    numGroups = 0
+    for path in sourcePaths:
+        if not path.is_file():
+            continue
+        source = SqliteStorage(path)
+        for groupId in source.iterGroupIds():
+            target = targets[getShard(groupId, numShards)]
+            state = source.load(groupId)
+            if state is not None:
+                target.save(groupId, state)
+            target.appendEvents((groupId, index, event) for (index, event) in enumerate(source.loadEvents(groupId)))
+            numGroups += 1
+        source.close()
+    for target in targets:
+        target.close()
+    getLayoutPath(database).write_text(str(numShards))
+    for path in sourcePaths:
+        for suffix in ("", "-wal", "-shm"):
+            Path(str(path) + suffix).unlink(missing_ok=True)
+    logger.info("Moved {:,} groups".format(numGroups))
+
+
+class ShardTransport:
+    """Receives the updates of one shard from the dispatcher and sends the replies through transport."""
+
+    def __init__(self, transport, updateQueue):
+        self.transport = transport
+        self.updateQueue = updateQueue
+        self.stopped = False
+        self.numUpdates = 0
+
+    async def getUpdates(self):
+        if self.stopped:
+            raise Stopped()
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                updates = [await loop.run_in_executor(None, self.updateQueue.get, True, queueTimeout)]
+                break
+            except queue.Empty:
+                pass
+        while True:
+            try:
+                updates.append(self.updateQueue.get_nowait())
+            except queue.Empty:
+                break
+        # None tells the worker to stop once it handled the updates before it
+        if None in updates:
+            self.stopped = True
+            updates = updates[: updates.index(None)]
+        self.numUpdates += len(updates)
+        return updates
+
+    def getUsername(self):
+        return self.transport.getUsername()
+
+    async def sendMessage(self, chatId, text, parseMode=None):
+        await self.transport.sendMessage(chatId, text, parseMode)
+
+    async def deleteMessages(self, chatId, messageIds):
+        await self.transport.deleteMessages(chatId, messageIds)
+
+
+def runWorker(shard, numShards, database, updateQueue, makeTransport, globalRate=defaultGlobalRate, args=None, resultQueue=None):
+    """Runs the bot for one shard. makeTransport creates the transport that the replies are sent through.
+    globalRate is the limit of the whole bot, which the shards share."""
+    from main import GuessBot, statisticsDatabase
+    from playerStatistics import StatisticsStore
+
+    storage = SqliteStorage(getShardDatabase(database, shard, numShards))
+    # All shards share the statistics, so that the leaderboard covers every group
+    statistics = StatisticsStore(Path(database).with_name(statisticsDatabase))
+    bot = GuessBot(storage, statistics)
+    transport = ShardTransport(makeTransport(), updateQueue)
+    bot.username = transport.getUsername()
+    runtime = Runtime(bot, transport, outbox=Outbox(transport, globalRate=globalRate / numShards))
+    if args is not None:
+        if args.metricsFile is not None:
+            args.metricsFile = str(Path(args.metricsFile).with_suffix(".{}-of-{}.json".format(shard, numShards)))
+        if args.metricsPort is not None:
+            args.metricsPort += shard
+        bot.setupMetrics(args, runtime)
+        bot.reportStartup(args.startupBudget)
+    if resultQueue is not None:
+        resultQueue.put(("ready", shard))
+    try:
+        runUntilInterrupted(runtime.run())
+    except Stopped:
+        pass
+    storage.close()
+    statistics.close()
+    if resultQueue is not None:
+        resultQueue.put(("done", shard, transport.numUpdates))
+
+
+class Dispatcher:
+    """Routes the updates to the shards. With restartWorker, workers that exited are started again with the same update queue."""
+
+    def __init__(self, transport, updateQueues, workers=None, restartWorker=None):
+        self.transport = transport
+        self.updateQueues = updateQueues
+        self.workers = workers
+        self.restartWorker = restartWorker
+
+    def dispatch(self, update):
+        self.updateQueues[getShard(update.effective_chat.id, len(self.updateQueues))].put(update)
+
+    def checkWorkers(self):
+        for (shard, worker) in enumerate(self.workers):
+            if not worker.is_alive():
+                logger.warning("Shard {} exited with code {}, restarting it".format(shard, worker.exitcode))
+                self.workers[shard] = self.restartWorker(shard)
+
+    async def run(self):
+        while True:
+            updates = await pollUpdates(self.transport)
+            if self.restartWorker is not None:
+                self.checkWorkers()
+            for update in updates:
+                self.dispatch(update)
+
+    def stop(self):
+        for updateQueue in self.updateQueues:
+            updateQueue.put(None)
+
+
+def startWorker(shard, numShards, database, updateQueue, makeTransport, globalRate=defaultGlobalRate, args=None, resultQueue=None):
+    worker = multiprocessing.Process(
+        target=runWorker, args=(shard, numShards, database, updateQueue, makeTransport, globalRate, args, resultQueue), name="Shard{}".format(shard)
+    )
+    worker.start()
+    return worker
+
+
+def startWorkers(numShards, database, makeTransport, globalRate=defaultGlobalRate, args=None, resultQueue=None):
+    updateQueues = [multiprocessing.Queue() for _ in range(numShards)]
+    workers = [startWorker(shard, numShards, database, updateQueues[shard], makeTransport, globalRate, args, resultQueue) for shard in range(numShards)]
+    return (updateQueues, workers)
+
+
+def runSharded(transport, numShards, database, makeTransport, globalRate=defaultGlobalRate, args=None):
+    """Polls transport for updates and lets numShards worker processes handle them until interrupted."""
+    rebalance(database, numShards)
+    (updateQueues, workers) = startWorkers(numShards, database, makeTransport, globalRate, args)
+
+    def restartWorker(shard):
+        return startWorker(shard, numShards, database, updateQueues[shard], makeTransport, globalRate, args)
+
+    dispatcher = Dispatcher(transport, updateQueues, workers, restartWorker)
+    runUntilInterrupted(dispatcher.run())
+    dispatcher.stop()
+    for worker in workers:
+        worker.join()
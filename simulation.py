@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""Plays games without Telegram, with every player following a strategy, and reports the throughput and per-guess latency of Game."""
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import random
+import time
+from game import Game
+from gameSettings import GameSettings
+
+numLatencySamples = 10000
+maxNumGuessesPerGame = 100000
+
+
+class SimulatedPlayer:
+    def __init__(self, id_, strategy):
+        self.id = id_
+        self.name = "{}{}".format(strategy.__name__, id_)
+        self.strategy = strategy
+        self.score = 0
+
+    def __repr__(self):
+        return self.name
+
+
+def getSignChanges(game):
+    signs = game.guessedValues.signs
+    values = game.guessedValues.values
+    return [(x1, x2) for (x1, x2) in zip(values, values[1:]) if signs[x1] * signs[x2] < 0 and x2 - x1 > 1]
+
+
+def guessRandomly(game, rng):
+    while True:
+        x = rng.randint(game.function.lowerBound, game.function.upperBound)
+        if x not in game.guessedValues:
+            return x
+
+
+def guessByBisection(game, rng):
+    """Halve the largest interval with a sign change, or the largest interval without guesses if there is none."""
+    obviousRoot = game.getFirstObviousRoot()
+    if obviousRoot is not None:
+        return obviousRoot
+    intervals = getSignChanges(game)
+    if len(intervals) == 0:
+        values = [game.function.lowerBound - 1] + game.guessedValues.values + [game.function.upperBound + 1]
+        intervals = [(x1, x2) for (x1, x2) in zip(values, values[1:]) if x2 - x1 > 1]
+    (x1, x2) = max(intervals, key=lambda interval: interval[1] - interval[0])
+    return (x1 + x2) // 2
+
+
+def guessGreedily(game, rng):
+    """Walk into the smallest interval with a sign change from its left side, since it is closest to a sure root."""
+    obviousRoot = game.getFirstObviousRoot()
+    if obviousRoot is not None:
+        return obviousRoot
+    intervals = getSignChanges(game)
+    if len(intervals) == 0:
+        return guessRandomly(game, rng)
+    (x1, x2) = min(intervals, key=lambda interval: interval[1] - interval[0])
+    return x1 + 1
+
+
+strategies = {
+    "random": guessRandomly,
+    "bisection": guessByBisection,
+    "greedy": guessGreedily,
+}
+
+
+def simulate(numGames, strategyNames, seed, settingValues=None):
+    """Play numGames games in a single Game instance. Returns the number of played games, the number of guesses,
+    the total time spent in Game.handlePlayerGuess and a uniform sample of the per-guess latencies."""
+    rng = random.Random(seed)
+    settings = GameSettings().update(settingValues or {})
+    players = [SimulatedPlayer(i, strategies[name]) for (i, name) in enumerate(strategyNames)]
+    game = Game(players, settings, seed=rng.getrandbits(64))
+    latencies = []
+    numGuesses = 0
+    totalTime = 0.0
+    for _ in range(numGames):
+        for numGuessesInGame in range(maxNumGuessesPerGame):
+            player = game.turnOrder.currentPlayer
+            x = player.strategy(game, rng)
+            start = time.perf_counter()
+            game.handlePlayerGuess(player, x)
+            latency = time.perf_counter() - start
+            totalTime += latency
+            numGuesses += 1
+            # Reservoir sampling keeps a uniform sample of all latencies
+            if len(latencies) < numLatencySamples:
+                latencies.append(latency)
+            else:
+                index = rng.randrange(numGuesses)
+                if index < numLatencySamples:
+                    latencies[index] = latency
+            gameOver = next(game.log.iterEvents("gameOver"), None) is not None
+            game.log.clear()
+            if gameOver:
+                break
+    return (numGames, numGuesses, totalTime, latencies)
+
+
+def simulateInParallel(numGames, strategyNames, seed, numProcesses, settingValues=None):
+    numGamesPerProcess = [numGames // numProcesses + (1 if i < numGames % numProcesses else 0) for i in range(numProcesses)]
+    with ProcessPoolExecutor(numProcesses) as executor:
+        futures = [
+            executor.submit(simulate, num, strategyNames, seed + i, settingValues) for (i, num) in enumerate(numGamesPerProcess) if num > 0
+        ]
+        results = [future.result() for future in futures]
+    latencies = sorted(latency for result in results for latency in result[3])
+    return (sum(result[0] for result in results), sum(result[1] for result in results), latencies)
+
+
+def getPercentile(sortedValues, percentile):
+    return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * percentile / 100))]
+
+
+def parseSettings(settingStrings):
+    settingValues = {}
+    for settingString in settingStrings:
+        (k, v) = settingString.split("=")
+        settingValues[k] = int(v)
+    return settingValues
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--numGames", type=int, default=10000)
+    parser.add_argument("--strategies", default="bisection,greedy", help="Comma separated strategies of the players: " + ", ".join(strategies))
+    parser.add_argument("--numProcesses", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--set", nargs="*", default=[], help="Game settings, e.g. --set upperBound=10000 autoRecap=0")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    (numGames, numGuesses, latencies) = simulateInParallel(args.numGames, args.strategies.split(","), args.seed, args.numProcesses, parseSettings(args.set))
+    duration = time.perf_counter() - start
+    print("{:,} games with {:,} guesses in {:.2f}s on {} processes".format(numGames, numGuesses, duration, args.numProcesses))
+    print("{:,.0f} games/s, {:,.0f} guesses/s".format(numGames / duration, numGuesses / duration))
+    print("guess latency: " + ", ".join("p{} = {:.1f}us".format(p, getPercentile(latencies, p) * 1e6) for p in [50, 90, 99, 99.9]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import bisect
+
+# Larger intervals are only enumerated once guesses have split them into smaller ones
+maxNumEnumeratedValues = 10000
+maxNumShownCandidates = 10
+
+
+class Solver:
+    """Keeps track of the values that can still be roots, given all guessed values of a game.
+    The functions are monic with integer roots, so every root r divides f(x) as a factor (x - r) for every
+    guessed x. The values that lie between two neighbouring guessed values form an interval. Each interval
+    that is small enough stores its remaining candidates, which are pruned by every new guess, so a guess
+    costs time proportional to the number of remaining candidates instead of the size of the domain.
+    An interval whose ends show a sign change contains an odd number of roots: if only a single candidate
+    is left there, it is a forced root. Above the upper bound the function is positive."""
+
+    def __init__(self, function):
+        self.function = function
+        self.lowerEnd = function.lowerBound - 1
+        self.upperEnd = function.upperBound + 1
+        self.values = []
+        self.signs = {self.lowerEnd: 0, self.upperEnd: 1}
+        self.nonzeroValues = {}
+        self.candidates = {}
+        self.forcedRoots = []
+        self.numCandidates = 0
+        self.setCandidates(self.lowerEnd, self.upperEnd, self.enumerateCandidates(self.lowerEnd, self.upperEnd))
+
+    def add(self, x):
+        if x in self.signs or not self.lowerEnd < x < self.upperEnd:
+            return
+        index = bisect.bisect_left(self.values, x)
+        left = self.values[index - 1] if index > 0 else self.lowerEnd
+        right = self.values[index] if index < len(self.values) else self.upperEnd
+        candidates = self.removeInterval(left, right)
+        self.values.insert(index, x)
+        value = self.function(x)
+        self.signs[x] = self.function.sign(x)
+        if value != 0:
+            self.nonzeroValues[x] = value
+            for (start, end) in list(self.iterEnumeratedIntervals()):
+                self.setCandidates(start, end, [r for r in self.candidates[start] if value % (x - r) == 0])
+        if candidates is None:
+            leftCandidates = self.enumerateCandidates(left, x)
+            rightCandidates = self.enumerateCandidates(x, right)
+        else:
+            split = bisect.bisect_left(candidates, x)
+            leftCandidates = self.prune(candidates[:split], x, value)
+            rightCandidates = self.prune(candidates[split:], x, value)
+        self.setCandidates(left, x, leftCandidates)
+        self.setCandidates(x, right, rightCandidates)
+
+    def prune(self, candidates, x, value):
+        return [r for r in candidates if r != x and (value == 0 or value % (x - r) == 0)]
+
+    def enumerateCandidates(self, start, end):
+        """The values strictly between start and end that are consistent with all guesses, or None if there are too many to check."""
+        if end - start - 1 > maxNumEnumeratedValues:
+            return None
+        # Check the closest guesses first since they rule out the most values
+        closestFirst = sorted(self.nonzeroValues.items(), key=lambda item: min(abs(item[0] - start), abs(item[0] - end)))
+        return [r for r in range(start + 1, end) if all(value % (x - r) == 0 for (x, value) in closestFirst)]
+
+    def iterEnumeratedIntervals(self):
+        for (start, end) in zip([self.lowerEnd] + self.values, self.values + [self.upperEnd]):
+            if self.candidates.get(start) is not None:
+                yield (start, end)
+
+    def setCandidates(self, start, end, candidates):
+        self.removeInterval(start, end)
+        self.candidates[start] = candidates
+        self.numCandidates += self.getNumCandidatesIn(start, end, candidates)
+        if candidates is not None and len(candidates) == 1 and self.hasSignChange(start, end):
+            bisect.insort(self.forcedRoots, candidates[0])
+
+    def removeInterval(self, start, end):
+        if start not in self.candidates:
+            return None
+        candidates = self.candidates.pop(start)
+        self.numCandidates -= self.getNumCandidatesIn(start, end, candidates)
+        if candidates is not None and len(candidates) == 1:
+            index = bisect.bisect_left(self.forcedRoots, candidates[0])
+            if index < len(self.forcedRoots) and self.forcedRoots[index] == candidates[0]:
+                del self.forcedRoots[index]
+        return candidates
+
+    def hasSignChange(self, start, end):
+        return self.signs[start] * self.signs[end] < 0
+
+    def getFirstForcedRoot(self):
+        if len(self.forcedRoots) == 0:
+            return None
+        return self.forcedRoots[0]
+
+    def getNarrowestInterval(self):
+        """The interval between a sign change with the fewest candidates, as (start, end, candidates). Candidates is None if they have not been enumerated."""
+        intervals = [(start, end) for (start, end) in zip([self.lowerEnd] + self.values, self.values + [self.upperEnd]) if self.hasSignChange(start, end)]
+        if len(intervals) == 0:
+            return None
+        (start, end) = min(intervals, key=lambda interval: self.getNumCandidatesIn(*interval, self.candidates[interval[0]]))
+        return (start, end, self.candidates[start])
+
+    def getNumCandidatesIn(self, start, end, candidates):
+        return end - start - 1 if candidates is None else len(candidates)
@@ -0,0 +1,129 @@
+from pathlib import Path
+import json
+import sqlite3
+import threading
+
+
+class YamlStorage:
+    """One YAML file per group in folder, named after the group id. The events of a group are appended to
+    <group id>.events as one JSON object per line."""
+
+    def __init__(self, folder):
+        # Imported here so that the default sqlite backend does not pay for it at startup
+        import yaml
+
+        self.yaml = yaml
+        self.loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        self.dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+        self.folder = Path(folder)
+        self.folder.mkdir(exist_ok=True)
+
+    def getPath(self, groupId):
+        return Path(self.folder, str(groupId))
+
+    def load(self, groupId):
+        path = self.getPath(groupId)
+        if not path.is_file():
+            return None
+        with path.open("r") as f:
+            return self.yaml.load(f, Loader=self.loader)
+
+    def save(self, groupId, state):
+        with self.getPath(groupId).open("w") as f:
+            self.yaml.dump(state, f, Dumper=self.dumper)
+
+    def saveMany(self, items):
+        for (groupId, state) in items:
+            self.save(groupId, state)
+
+    def getEventPath(self, groupId):
+        return Path(self.folder, "{}.events".format(groupId))
+
+    def appendEvents(self, items):
+        eventsByGroup = {}
+        for (groupId, _, event) in items:
+            eventsByGroup.setdefault(groupId, []).append(json.dumps(event) + "\n")
+        for (groupId, lines) in eventsByGroup.items():
+            with self.getEventPath(groupId).open("a") as f:
+                f.writelines(lines)
+
+    def loadEvents(self, groupId, start=0):
+        path = self.getEventPath(groupId)
+        if not path.is_file():
+            return []
+        with path.open("r") as f:
+            return [json.loads(line) for line in f.readlines()[start:]]
+
+    def iterGroupIds(self):
+        """The ids of all groups with a snapshot or events. Only lists the folder, nothing is parsed."""
+        groupIds = set()
+        for path in self.folder.iterdir():
+            if path.suffix in ("", ".events"):
+                groupIds.add(int(path.stem))
+        return iter(groupIds)
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """All groups in a single SQLite database, one JSON encoded row per group and one per event."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS groups (id INTEGER PRIMARY KEY, state TEXT NOT NULL)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS events (groupId INTEGER NOT NULL, idx INTEGER NOT NULL, event TEXT NOT NULL, PRIMARY KEY (groupId, idx))"
+        )
+        self.connection.commit()
+
+    def load(self, groupId):
+        with self.lock:
+            row = self.connection.execute("SELECT state FROM groups WHERE id = ?", (groupId,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def save(self, groupId, state):
+        self.saveMany([(groupId, state)])
+
+    def saveMany(self, items):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO groups (id, state) VALUES (?, ?)",
+                ((groupId, json.dumps(state, separators=(",", ":"))) for (groupId, state) in items),
+            )
+
+    def appendEvents(self, items):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO events (groupId, idx, event) VALUES (?, ?, ?)",
+                ((groupId, index, json.dumps(event, separators=(",", ":"))) for (groupId, index, event) in items),
+            )
+
+    def loadEvents(self, groupId, start=0):
+        with self.lock:
+            rows = self.connection.execute("SELECT event FROM events WHERE groupId = ? AND idx >= ? ORDER BY idx", (groupId, start)).fetchall()
+        return [json.loads(event) for (event,) in rows]
+
+    def iterGroupIds(self):
+        with self.lock:
+            groupIds = {groupId for (groupId,) in self.connection.execute("SELECT id FROM groups")}
+            groupIds.update(groupId for (groupId,) in self.connection.execute("SELECT DISTINCT groupId FROM events"))
+        return iter(groupIds)
+
+    def close(self):
+        self.connection.close()
+
+
+backends = {
+    "yaml": YamlStorage,
+    "sqlite": SqliteStorage,
+}
+
+
+def openStorage(backend, path):
+    return backends[backend](path)
@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+import asyncio
+import functools
+import time
+
+# Updates are polled while replies are sent, several at a time
+connectionPoolSize = 8
+
+
+class RateLimited(Exception):
+    def __init__(self, retryAfter):
+        super().__init__("Rate limited, retry after {}s".format(retryAfter))
+        self.retryAfter = retryAfter
+
+
+class Stopped(Exception):
+    """Raised by getUpdates of transports that will not deliver any more updates."""
+
+
+def makeUpdate(updateId, chatId, userId, firstName, messageId, text, chatType="group"):
+    return SimpleNamespace(
+        update_id=updateId,
+        effective_chat=SimpleNamespace(id=chatId, type=chatType),
+        effective_user=SimpleNamespace(id=userId, first_name=firstName),
+        message=SimpleNamespace(message_id=messageId, text=text),
+    )
+
+
+class TelegramTransport:
+    """Talks to the Telegram Bot API. The blocking calls of python-telegram-bot are run in the default executor.
+    baseUrl replaces https://api.telegram.org/bot, e.g. to use a local fake server."""
+
+    def __init__(self, token, pollTimeout=10, baseUrl=None):
+        import telegram
+        from telegram.utils.request import Request
+
+        self.telegram = telegram
+        self.bot = telegram.Bot(token, base_url=baseUrl, request=Request(con_pool_size=connectionPoolSize))
+        self.pollTimeout = pollTimeout
+        self.offset = None
+
+    async def run(self, function, **kwargs):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, functools.partial(function, **kwargs))
+        except self.telegram.error.RetryAfter as e:
+            raise RateLimited(e.retry_after)
+
+    def getUsername(self):
+        return self.bot.username
+
+    async def getUpdates(self):
+        updates = await self.run(self.bot.get_updates, offset=self.offset, timeout=self.pollTimeout)
+        if len(updates) > 0:
+            self.offset = updates[-1].update_id + 1
+        return [convertUpdate(update) for update in updates if update.message is not None and update.message.text is not None]
+
+    async def sendMessage(self, chatId, text, parseMode=None):
+        await self.run(self.bot.send_message, chat_id=chatId, text=text, parse_mode=parseMode)
+
+    async def deleteMessages(self, chatId, messageIds):
+        await asyncio.gather(*(self.run(self.bot.delete_message, chat_id=chatId, message_id=messageId) for messageId in messageIds))
+
+
+def convertUpdate(update):
+    chat = update.effective_chat
+    user = update.effective_user
+    return makeUpdate(update.update_id, chat.id, user.id, user.first_name, update.message.message_id, update.message.text, chat.type)
+
+
+class FakeTransport:
+    """An in-memory stand-in for Telegram, to run the bot offline. Every call takes latency seconds.
+    Like Telegram, it refuses messages that are sent to a chat less than chatInterval seconds apart."""
+
+    def __init__(self, latency=0.0, chatInterval=0.0):
+        self.latency = latency
+        self.chatInterval = chatInterval
+        self.lastMessageTimes = {}
+        self.pendingUpdates = asyncio.Queue()
+        self.sentMessages = []
+        self.deletedMessages = []
+
+    def getUsername(self):
+        # Commands addressed to any bot are handled
+        return None
+
+    def addUpdate(self, update):
+        self.pendingUpdates.put_nowait(update)
+
+    async def getUpdates(self):
+        updates = [await self.pendingUpdates.get()]
+        while not self.pendingUpdates.empty():
+            updates.append(self.pendingUpdates.get_nowait())
+        return updates
+
+    async def sendMessage(self, chatId, text, parseMode=None):
+        now = time.monotonic()
+        timeSinceLastMessage = now - self.lastMessageTimes.get(chatId, float("-inf"))
+        if timeSinceLastMessage < self.chatInterval:
+            raise RateLimited(self.chatInterval - timeSinceLastMessage)
+        self.lastMessageTimes[chatId] = now
+        await asyncio.sleep(self.latency)
+        self.sentMessages.append((time.perf_counter(), chatId, text, parseMode))
+
+    async def deleteMessages(self, chatId, messageIds):
+        await asyncio.sleep(self.latency)
+        now = time.perf_counter()
+        self.deletedMessages.extend((now, chatId, messageId) for messageId in messageIds)
@@ -1,19 +1,31 @@
-import itertools
+maxNumRemainingGuesses = 100
 
 
 class TurnOrder:
+    __slots__ = ("players", "numTurns", "playerIndices", "nextPlayerIndices", "playerIndex", "remainingTurns", "currentPlayersFirstTurn")
+
     def __init__(self, players, numTurns):
-        self.turnOrder = repeatedCycle(players, numTurns)
-        self.currentPlayer = next(self.turnOrder)
         self.players = players
+        self.numTurns = numTurns
+        self.playerIndices = {player: i for (i, player) in enumerate(players)}
+        self.nextPlayerIndices = getNextPlayerIndices(numTurns)
+        self.playerIndex = self.nextPlayerIndices[-1]
+        self.remainingTurns = numTurns[self.playerIndex]
         self.currentPlayersFirstTurn = True
 
+    @property
+    def currentPlayer(self):
+        return self.players[self.playerIndex]
+
     def isPlayersTurn(self, player):
         return player == self.currentPlayer
 
     def nextTurn(self):
         previousPlayer = self.currentPlayer
-        self.currentPlayer = next(self.turnOrder)
+        self.remainingTurns -= 1
+        if self.remainingTurns == 0:
+            self.playerIndex = self.nextPlayerIndices[self.playerIndex]
+            self.remainingTurns = self.numTurns[self.playerIndex]
         self.currentPlayersFirstTurn = self.currentPlayer != previousPlayer
 
     def getPlayerAndMakeTurn(self):
@@ -21,18 +33,102 @@ class TurnOrder:
         return self.currentPlayer
 
     def setPlayer(self, player):
-        assert player in self.players
-        while self.currentPlayer != player:
-            self.nextTurn()
+        assert player in self.playerIndices
+        if self.currentPlayer != player:
+            self.playerIndex = self.playerIndices[player]
+            assert self.numTurns[self.playerIndex] > 0
+            self.remainingTurns = self.numTurns[self.playerIndex]
+            self.currentPlayersFirstTurn = True
 
     def numRemainingGuesses(self):
-        self.turnOrder, order = itertools.tee(self.turnOrder)
-        numRemaining = 1
-        while self.currentPlayer == next(order) and numRemaining < 100:  # oops
-            numRemaining += 1
-        return numRemaining
+        # The current player keeps guessing forever if nobody else has any turns
+        if self.nextPlayerIndices[self.playerIndex] == self.playerIndex:
+            return maxNumRemainingGuesses
+        return min(self.remainingTurns, maxNumRemainingGuesses)
+
+    def getState(self):
+        return {
+            "numTurns": self.numTurns,
+            "playerIndex": self.playerIndex,
+            "remainingTurns": self.remainingTurns,
+            "currentPlayersFirstTurn": self.currentPlayersFirstTurn,
+        }
+
+    @staticmethod
+    def fromState(players, state):
+        turnOrder = TurnOrder(players, state["numTurns"])
+        if "position" in state:
+            # Saved by the previous, cycle based turn order
+            for _ in range(state["position"]):
+                turnOrder.nextTurn()
+        else:
+            turnOrder.playerIndex = state["playerIndex"]
+            turnOrder.remainingTurns = state["remainingTurns"]
+        turnOrder.currentPlayersFirstTurn = state["currentPlayersFirstTurn"]
+        return turnOrder
+
+
+def getNextPlayerIndices(numTurns):
+    """For each player, the index of the next player (cyclically) that has any turns. The last entry is the
+    first player with any turns, since the search for it starts after the last player."""
+    if not any(num > 0 for num in numTurns):
+        raise ValueError("At least one player needs to have a turn")
+    nextPlayerIndices = [None for _ in numTurns]
+    nextIndex = None
+    for i in reversed(range(2 * len(numTurns))):
+        index = i % len(numTurns)
+        nextPlayerIndices[index] = nextIndex
+        if numTurns[index] > 0:
+            nextIndex = index
+    return nextPlayerIndices
+
+
+if __name__ == "__main__":
+    # Differential check against the previous, itertools based implementation
+    import itertools
+    import random
+
+    class CycleTurnOrder:
+        def __init__(self, players, numTurns):
+            self.turnOrder = itertools.cycle([item for (item, num) in zip(players, numTurns) for _ in range(num)])
+            self.currentPlayer = next(self.turnOrder)
+            self.players = players
+            self.currentPlayersFirstTurn = True
+
+        def nextTurn(self):
+            previousPlayer = self.currentPlayer
+            self.currentPlayer = next(self.turnOrder)
+            self.currentPlayersFirstTurn = self.currentPlayer != previousPlayer
+
+        def setPlayer(self, player):
+            while self.currentPlayer != player:
+                self.nextTurn()
 
+        def numRemainingGuesses(self):
+            self.turnOrder, order = itertools.tee(self.turnOrder)
+            numRemaining = 1
+            while self.currentPlayer == next(order) and numRemaining < 100:
+                numRemaining += 1
+            return numRemaining
 
-def repeatedCycle(items, numTurns):
-    repeatedItems = [item for (item, num) in zip(items, numTurns) for _ in range(num)]
-    return itertools.cycle(repeatedItems)
+    rng = random.Random(0)
+    for _ in range(2000):
+        players = ["p{}".format(i) for i in range(rng.randint(1, 5))]
+        numTurns = [rng.choice([0, 1, 1, 2, 3, 150]) for _ in players]
+        if not any(numTurns):
+            continue
+        old = CycleTurnOrder(players, numTurns)
+        new = TurnOrder(players, numTurns)
+        for _ in range(300):
+            if rng.random() < 0.1:
+                player = rng.choice([p for (p, num) in zip(players, numTurns) if num > 0])
+                old.setPlayer(player)
+                new.setPlayer(player)
+            else:
+                old.nextTurn()
+                new.nextTurn()
+            if rng.random() < 0.05:
+                new = TurnOrder.fromState(players, new.getState())
+            assert (old.currentPlayer, old.currentPlayersFirstTurn) == (new.currentPlayer, new.currentPlayersFirstTurn)
+            assert old.numRemainingGuesses() == new.numRemainingGuesses()
+    print("TurnOrder matches the cycle based implementation")
@@ -1,5 +1,16 @@
+import re
+
+
 def tryConvertToInt(content):
     try:
         return int(content)
     except (ValueError, TypeError) as e:
         return None
+
+
+def tryConvertToInts(content):
+    """The integers in a space or comma separated list, or None if it contains anything else."""
+    values = [tryConvertToInt(part) for part in re.split(r"[\s,]+", content.strip())]
+    if None in values:
+        return None
+    return values